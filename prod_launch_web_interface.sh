@@ -1,3 +1,3 @@
 #!/bin/bash
 source /env/bin/activate
-gunicorn timesheetbot.wsgi:application --bind 0.0.0.0:8000 --workers 2 --timeout 900
+gunicorn timesheetbot.wsgi:application -c python:timesheetbot.gunicorn_config --bind 0.0.0.0:8000 --workers 2 --timeout 900
@@ -22,8 +22,9 @@ setuptools.setup(
         "whitenoise >= 6",
         "pyyaml >= 6",
         "gspread >= 5",
-        "oauth2client >= 4",
-        "gspread-formatting >= 1",
+        "google-auth >= 2",
+        # Access tokens are stored encrypted
+        "cryptography >= 39",
         "gunicorn >= 20",
         "pytz >= 2022",
         "json_log_formatter >= 0.5",
@@ -1,6 +1,14 @@
 from django.contrib import admin
 
-from .models import User, WorkType, TimeEntry, NotificationHour, Program
+from .models import (
+    User,
+    WorkType,
+    TimeEntry,
+    NotificationHour,
+    Program,
+    SlackJob,
+    OffSlot,
+)
 
 
 @admin.register(User)
@@ -26,3 +34,13 @@ class NotificationHourAdmin(admin.ModelAdmin):
 @admin.register(Program)
 class ProgramAdmin(admin.ModelAdmin):
     pass
+
+
+@admin.register(SlackJob)
+class SlackJobAdmin(admin.ModelAdmin):
+    pass
+
+
+@admin.register(OffSlot)
+class OffSlotAdmin(admin.ModelAdmin):
+    pass
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class TimesheetbotConfig(AppConfig):
+    name = "timesheetbot"
+
+    def ready(self):
+        """Connects signal receivers once models are loaded"""
+
+        from . import signals  # noqa: F401
@@ -0,0 +1,85 @@
+import logging
+import os
+import psycopg2
+import psycopg2.pool
+import threading
+import timesheetbot.settings as settings
+import weakref
+
+from django.db.backends.postgresql.base import (
+    DatabaseWrapper as PostgresDatabaseWrapper,
+)
+
+logger = logging.getLogger(__name__)
+
+# Per process and connection parameters; created after forks, on first use
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(conn_params):
+    """Process-wide pool of connections to the configured database"""
+
+    pool_key = (os.getpid(), repr(sorted(conn_params.items())))
+    with _pools_lock:
+        if pool_key not in _pools:
+            # Connections given back are kept only up to the minimum: all are opened upfront
+            _pools[pool_key] = psycopg2.pool.ThreadedConnectionPool(
+                settings.config["POSTGRES_POOL_SIZE"],
+                settings.config["POSTGRES_POOL_SIZE"],
+                **conn_params,
+            )
+
+    return _pools[pool_key]
+
+
+def close_pools():
+    """Closes all connections of the process pools, e.g. before dropping their database"""
+
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.closeall()
+        _pools.clear()
+
+
+class PooledDatabase:
+    """psycopg2 module, whose connections come from a pool"""
+
+    def __init__(self):
+        self.pooled_connections = weakref.WeakKeyDictionary()
+
+    def __getattr__(self, name):
+        return getattr(psycopg2, name)
+
+    def connect(self, **conn_params):
+        """Takes an idle connection from the pool, opens a new one if the pool is full"""
+
+        pool = get_pool(conn_params)
+        try:
+            connection = pool.getconn()
+        except psycopg2.pool.PoolError:
+            logger.warning("Database connections pool is exhausted")
+            return psycopg2.connect(**conn_params)
+
+        self.pooled_connections[connection] = pool
+        return connection
+
+    def close(self, connection):
+        """Gives a connection back to its pool; broken ones are dropped by the pool"""
+
+        pool = self.pooled_connections.pop(connection, None)
+        if pool is None:
+            connection.close()
+        else:
+            pool.putconn(connection, close=bool(connection.closed))
+
+
+class DatabaseWrapper(PostgresDatabaseWrapper):
+    """Postgres backend whose connections are kept open in a pool once closed by Django"""
+
+    Database = PooledDatabase()
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                return self.Database.close(self.connection)
@@ -0,0 +1,50 @@
+"""Gunicorn hooks: the master serves the metrics of all workers on an internal port
+
+Loaded with `gunicorn -c python:timesheetbot.gunicorn_config`.
+"""
+
+import functools
+import shutil
+import tempfile
+import timesheetbot.settings as settings
+
+from timesheetbot.utils import metrics
+
+# Seconds between two snapshots of the metrics of a worker
+SNAPSHOT_INTERVAL_SECONDS = 5
+
+# Workers save their metrics there; created by the master, inherited by forked workers
+metrics_directory = None
+
+
+def on_starting(server):
+    """Serves the sum of the workers' snapshots, if metrics are enabled"""
+
+    global metrics_directory
+    if not settings.config["METRICS_PORT"]:
+        return
+
+    metrics_directory = tempfile.mkdtemp(prefix="timesheetbot-metrics-")
+    metrics.start_metrics_server(
+        settings.config["METRICS_PORT"],
+        functools.partial(metrics.render_snapshots, metrics_directory),
+    )
+
+
+def post_fork(server, worker):
+    """Each worker saves its metrics regularly"""
+
+    if metrics_directory is not None:
+        metrics.start_snapshot_writer(metrics_directory, SNAPSHOT_INTERVAL_SECONDS)
+
+
+def worker_exit(server, worker):
+    """Latest values of a stopping worker are kept: counters never go back"""
+
+    if metrics_directory is not None:
+        metrics.write_snapshot(metrics_directory)
+
+
+def on_exit(server):
+    if metrics_directory is not None:
+        shutil.rmtree(metrics_directory, ignore_errors=True)
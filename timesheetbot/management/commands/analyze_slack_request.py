@@ -20,6 +20,6 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         try:
-            SlackAnalyzer(options["request_file"]).analyze_and_respond()
+            SlackAnalyzer.from_json_file(options["request_file"]).analyze_and_respond()
         finally:
             os.remove(options["request_file"])
@@ -0,0 +1,127 @@
+import json
+import re
+import subprocess
+import sys
+import time
+import timesheetbot.settings as settings
+
+from django.core.management.base import BaseCommand, CommandError
+
+# From a cold interpreter to the loaded command, Django setup included: milliseconds, and modules loaded
+# A little above measured values (300-450 ms, 627-631 modules); eagerly importing gspread alone adds 329 modules
+IMPORT_BUDGETS = {
+    "analyze_slack_request": (500, 650),
+    "consume_slack_jobs": (500, 650),
+    "perform_hourly_tasks": (500, 650),
+    "refresh_off_slots": (500, 650),
+    "run_scheduler": (500, 650),
+}
+
+# Client libraries, only imported when actually used
+LAZY_MODULES = ("gspread", "google", "requests")
+
+# Top-level imports only: their cumulative times add up to the whole import time of the interpreter
+TOP_LEVEL_IMPORT_LINE_PATTERN = re.compile(r"^import time:\s+\d+ \|\s+(\d+) \| (\S+)$")
+
+# Prints the modules loaded in all, and the ones imported by the command, Django being set up first as manage.py does
+MEASURE_SCRIPT = """
+import django, json, sys
+django.setup()
+setup_modules = set(sys.modules)
+import {module_name}
+print(json.dumps([len(sys.modules), sorted(set(sys.modules) - setup_modules)]))
+"""
+
+
+def measure_command_import(command_name):
+    """Imports a command in a fresh interpreter: returns wall time (ms), total import time (ms), number of modules loaded
+    and modules imported by the command
+    """
+
+    module_name = f"timesheetbot.management.commands.{command_name}"
+    start = time.perf_counter()
+    completed_process = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            MEASURE_SCRIPT.format(module_name=module_name),
+        ],
+        cwd=settings.BASE_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    wall_time = (time.perf_counter() - start) * 1000
+
+    import_time = 0
+    for line in completed_process.stderr.splitlines():
+        match = TOP_LEVEL_IMPORT_LINE_PATTERN.match(line)
+        if match is not None:
+            import_time += int(match[1]) / 1000
+
+    module_count, imported_modules = json.loads(completed_process.stdout)
+
+    return wall_time, import_time, module_count, imported_modules
+
+
+class Command(BaseCommand):
+    """Django command interface class"""
+
+    help = "Measures the cold start of commands, and fails if over budget or importing client libraries eagerly"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--runs",
+            type=int,
+            default=5,
+            help="Number of fresh interpreters per command, the fastest being kept: noise only slows down",
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint when launched"""
+
+        failures = []
+        for command_name, (time_budget, module_budget) in sorted(
+            IMPORT_BUDGETS.items()
+        ):
+            wall_times = []
+            import_times = []
+            for _ in range(options["runs"]):
+                (
+                    wall_time,
+                    import_time,
+                    module_count,
+                    imported_modules,
+                ) = measure_command_import(command_name)
+                wall_times.append(wall_time)
+                import_times.append(import_time)
+
+            import_time = min(import_times)
+            self.stdout.write(
+                f"{command_name:<40} wall_ms={min(wall_times):.2f} "
+                + f"import_ms={import_time:.2f} budget_ms={time_budget} "
+                + f"modules={module_count} budget_modules={module_budget}"
+            )
+
+            if import_time > time_budget:
+                failures.append(
+                    f"{command_name}: imported in {import_time:.2f} ms, over {time_budget} ms"
+                )
+            if module_count > module_budget:
+                failures.append(
+                    f"{command_name}: loads {module_count} modules, over {module_budget}"
+                )
+            eager_modules = [
+                module
+                for module in imported_modules
+                if module.split(".")[0] in LAZY_MODULES
+            ]
+            if len(eager_modules):
+                failures.append(
+                    f"{command_name}: imports {', '.join(eager_modules[:5])} eagerly"
+                )
+
+        if len(failures):
+            raise CommandError("Import time regressions:\n" + "\n".join(failures))
@@ -0,0 +1,73 @@
+import signal
+import threading
+import logging
+import timesheetbot.settings as settings
+
+from timesheetbot.utils.metrics import report_metrics
+from timesheetbot.utils.slack_job_queue import (
+    SlackJobConsumer,
+    get_queue_depth,
+    purge_failed_slack_jobs,
+    requeue_stale_slack_jobs,
+)
+from django.core.management.base import BaseCommand
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """Django command interface class"""
+
+    help = "Consumes the Slack jobs queued by the webhook"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--consumers",
+            type=int,
+            default=settings.config["SLACK_JOB_CONSUMERS"],
+            help="Number of consumer threads",
+        )
+        parser.add_argument(
+            "--batch_size",
+            type=int,
+            default=settings.config["SLACK_JOB_BATCH_SIZE"],
+            help="Maximum number of jobs claimed at once, and handled in parallel, by a consumer",
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint when launched"""
+
+        # Stop gracefully: consumers finish their current batch
+        stop_event = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+        signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+
+        consumers = [
+            SlackJobConsumer(
+                f"slack-consumer-{consumer_num}",
+                options["batch_size"],
+                settings.config["SLACK_JOB_POLL_INTERVAL_SECONDS"],
+                stop_event,
+            )
+            for consumer_num in range(options["consumers"])
+        ]
+        for consumer in consumers:
+            consumer.start()
+
+        # Meanwhile: recover jobs of dead consumers, purge old failed ones, report queue depth and metrics
+        while not stop_event.is_set():
+            try:
+                requeue_stale_slack_jobs(
+                    settings.config["SLACK_JOB_STALE_AFTER_SECONDS"],
+                    settings.config["SLACK_JOB_MAX_ATTEMPTS"],
+                )
+                purge_failed_slack_jobs(settings.config["SLACK_JOB_RETENTION_DAYS"])
+                logger.info(f"Slack jobs queue depth: {get_queue_depth()}")
+                report_metrics("slack_consumer")
+            except Exception:
+                logger.exception("Error while monitoring the Slack jobs queue")
+
+            stop_event.wait(settings.config["SLACK_JOB_REPORT_INTERVAL_SECONDS"])
+
+        for consumer in consumers:
+            consumer.join()
@@ -1,9 +1,21 @@
-from timesheetbot.models import User
-from timesheetbot.utils.user_analyzer import UserAnalyzer
-from timesheetbot.utils.google_sheet_writer import GoogleSheetWriter
+import logging
+
+from timesheetbot.utils.bulk_user_analyzer import (
+    BulkUserAnalyzer,
+    get_users_due_for_notification,
+    maintain_users_analysis_mindate,
+)
+from timesheetbot.utils.google_sheet_writer import (
+    GoogleSheetWriter,
+    get_time_entries_to_write,
+)
+from timesheetbot.utils.metrics import hourly_tasks_seconds, report_metrics
+from timesheetbot.utils.off_slot_reader import OffSlotReader
 
 from django.core.management.base import BaseCommand
 
+logger = logging.getLogger(__name__)
+
 
 class Command(BaseCommand):
     """Django command interface class"""
@@ -13,11 +25,41 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         """Entrypoint when launched"""
 
-        # For each user: sends notifications if needed, updates analysis startpoint if needed
-        for one_user in User.objects.values("pk").all():
-            user_analyzer = UserAnalyzer(one_user["pk"])
-            user_analyzer.launch_notifications()
-            user_analyzer.update_user_analysis_mindate()
+        # A summary of each run is reported, even a failed one
+        try:
+            with hourly_tasks_seconds.time():
+                self.perform_tasks()
+        finally:
+            report_metrics("hourly_tasks")
+
+    def perform_tasks(self):
+        """Reads days off, notifies users, then writes new data"""
+
+        # Google is only called when needed: connecting alone may exchange an access token
+        sheet_writer = None
+
+        # Days off must be known before notifying users due this hour; if the sheet is unreachable, known ones are used
+        due_users = list(get_users_due_for_notification())
+        if len(due_users):
+            try:
+                sheet_writer = GoogleSheetWriter()
+                OffSlotReader(sheet_writer).refresh()
+            except Exception:
+                logger.exception("Error while reading days off from the sheet")
+                sheet_writer = None
+
+        # Only users due this hour are analyzed: sends notifications if needed, updates analysis startpoint
+        bulk_user_analyzer = BulkUserAnalyzer(due_users)
+        try:
+            bulk_user_analyzer.launch_notifications()
+            bulk_user_analyzer.update_users_analysis_mindate()
+        finally:
+            # Even if a notification failed, already sent ones must be remembered
+            bulk_user_analyzer.save()
+
+        # Once a day, analysis startpoints of everyone are moved forward
+        maintain_users_analysis_mindate()
 
         # Writes new data in the google sheet
-        GoogleSheetWriter().write_all_new_data()
+        if get_time_entries_to_write().exists():
+            (sheet_writer or GoogleSheetWriter()).write_all_new_data()
@@ -0,0 +1,81 @@
+from timesheetbot.models import User, UserSlotSummary
+from timesheetbot.utils.slot_summary import (
+    compute_needed_until,
+    get_slot_summaries,
+    load_time_slots,
+    save_slot_summaries,
+    set_missing_time_slots,
+)
+from timesheetbot.utils.time_slot import get_time_slot
+from timesheetbot.utils.user_analyzer import compute_needed_data
+from django.core.management.base import BaseCommand, CommandError
+
+COMPARED_FIELDS = [
+    "missing_time_slots",
+    "missing_count",
+    "first_missing_time_slot",
+    "last_filled_time_slot",
+]
+
+
+class Command(BaseCommand):
+    """Django command interface class"""
+
+    help = "Computes missing slots summaries from scratch, and stores them or compares them to the maintained ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only reports the maintained summaries differing from scratch, and fails if any",
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint when launched"""
+
+        users = list(User.objects.all())
+
+        # Maintained summaries are first brought up to date, as any use would do
+        maintained_summaries = get_slot_summaries(users) if options["check"] else {}
+
+        filled_time_slots, off_time_slots = load_time_slots(
+            {
+                user.pk: get_time_slot(user.look_for_data_starting_at, True)
+                for user in users
+            }
+        )
+        rebuilt_summaries = []
+        mismatch_count = 0
+        for user in users:
+            summary = UserSlotSummary(
+                user=user,
+                analysis_start=user.look_for_data_starting_at,
+                needed_until_time_slot=compute_needed_until(user),
+                last_filled_time_slot=max(filled_time_slots[user.pk], default=None),
+            )
+            set_missing_time_slots(
+                summary,
+                compute_needed_data(user)
+                - filled_time_slots[user.pk]
+                - off_time_slots[user.pk],
+            )
+            rebuilt_summaries.append(summary)
+
+            if options["check"]:
+                for field in COMPARED_FIELDS:
+                    maintained_value = getattr(maintained_summaries[user.pk], field)
+                    if maintained_value != getattr(summary, field):
+                        mismatch_count += 1
+                        self.stderr.write(
+                            f"{user}: {field} is {maintained_value}, "
+                            + f"{getattr(summary, field)} expected"
+                        )
+
+        if options["check"]:
+            if mismatch_count:
+                raise CommandError(f"{mismatch_count} mismatching summary fields")
+            self.stdout.write(f"{len(users)} summaries are consistent")
+            return
+
+        save_slot_summaries(rebuilt_summaries)
+        self.stdout.write(f"{len(users)} summaries rebuilt")
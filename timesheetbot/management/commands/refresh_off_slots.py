@@ -0,0 +1,27 @@
+from timesheetbot.utils.google_sheet_writer import GoogleSheetWriter
+from timesheetbot.utils.off_slot_reader import OffSlotReader
+from timesheetbot.models import OffSlotSync
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    """Django command interface class"""
+
+    help = "Reads days off (colored half-days) from the weekly sheets"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Reads all sheets again, even the ones unchanged since their last reading",
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint when launched"""
+
+        if options["full"]:
+            OffSlotSync.objects.all().delete()
+
+        sheet_writer = GoogleSheetWriter()
+        sheet_count = OffSlotReader(sheet_writer).refresh()
+        self.stdout.write(f"{sheet_count} sheets read")
@@ -0,0 +1,450 @@
+import contextlib
+import functools
+import hashlib
+import hmac
+import json
+import logging
+import requests
+import time
+import timesheetbot.settings as settings
+import urllib.parse
+
+from timesheetbot.models import Program, TimeEntry, User, WorkType
+from timesheetbot.utils.benchmark import (
+    create_synthetic_data,
+    format_summary,
+    measure,
+    summarize_durations,
+)
+from timesheetbot.utils.fake_services import FakeSheetsServer, FakeSlackServer
+from timesheetbot.utils.google_sheet_writer import GoogleSheetWriter
+from timesheetbot.utils.query_sender import QuerySender
+from timesheetbot.utils.slack_analyzer import NEXT_MODAL_SENT_KEY, SlackAnalyzer
+from timesheetbot.utils.slack_query_handler import handle_slack
+from timesheetbot.utils.time_slot import get_time_slot
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.utils import load_backend
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+
+@contextlib.contextmanager
+def benchmark_environment(options):
+    """Throwaway database filled with synthetic data, fake Slack & Sheets APIs plugged in"""
+
+    fake_server_options = {
+        "handshake_latency": options["handshake_ms"] / 1000,
+        "latency": options["latency_ms"] / 1000,
+        "rate_limit_every": options["rate_limit_every"],
+    }
+    initial_config = dict(settings.config)
+    old_database_name = connection.creation.create_test_db(
+        verbosity=0, autoclobber=True
+    )
+    try:
+        with FakeSlackServer(**fake_server_options) as slack_server, FakeSheetsServer(
+            **fake_server_options
+        ) as sheets_server:
+            settings.config.update(
+                {
+                    "SLACK_CHAT_API_URL": slack_server.base_url
+                    + "/api/chat.postMessage",
+                    "SLACK_VIEW_API_URL": slack_server.base_url + "/api/views.open",
+                    "GSPREAD_API_BASE_URL": sheets_server.base_url,
+                    "GSPREAD_SHEET": "https://docs.google.com/spreadsheets/d/benchmark/edit",
+                    # Synthetic users are due every hour, every day
+                    "SKIP_NOTIFICATIONS_ON_WE": False,
+                }
+            )
+            create_synthetic_data(options["users"], options["backlog_days"])
+            yield slack_server, sheets_server
+    finally:
+        settings.config.clear()
+        settings.config.update(initial_config)
+        connection.creation.destroy_test_db(old_database_name, verbosity=0)
+
+
+def measure_runs(command, name, function, runs, fake_servers, reset=None):
+    """Measures `runs` calls of `function`, reporting latencies, DB queries and API calls per call"""
+
+    durations = []
+    query_counts = []
+    api_call_counts = {}
+    error_count = 0
+
+    # A failed call is measured too, e.g. when injected rate limits are not handled
+    def function_or_error():
+        nonlocal error_count
+        try:
+            function()
+        except Exception:
+            error_count += 1
+
+    for _ in range(runs):
+        if reset is not None:
+            reset()
+        for fake_server in fake_servers:
+            fake_server.reset_counts()
+
+        with CaptureQueriesContext(connection) as captured_queries:
+            durations += measure(function_or_error, 1)
+        query_counts.append(len(captured_queries))
+
+        for fake_server in fake_servers:
+            for api_method, count in fake_server.request_counts.items():
+                api_call_counts[api_method] = api_call_counts.get(api_method, 0) + count
+            api_call_counts["rate_limited"] = (
+                api_call_counts.get("rate_limited", 0) + fake_server.rate_limited_count
+            )
+
+    summary = summarize_durations(durations)
+    summary["errors"] = error_count
+    summary["db_queries"] = sum(query_counts) / runs
+    summary.update(
+        {
+            f"api:{api_method}": count / runs
+            for api_method, count in sorted(api_call_counts.items())
+        }
+    )
+    command.report(name, summary)
+
+
+def build_signed_request(data):
+    """A webhook request, as Slack would post it"""
+
+    body = ("payload=" + urllib.parse.quote_plus(json.dumps(data))).encode("utf-8")
+    request_timestamp = str(int(time.time()))
+    signature = (
+        "v0="
+        + hmac.new(
+            settings.config["SLACK_SIGNING_SECRET"].encode("utf-8"),
+            ("v0:" + request_timestamp + ":").encode("utf-8") + body,
+            hashlib.sha256,
+        ).hexdigest()
+    )
+
+    return RequestFactory().post(
+        "/",
+        data=body,
+        content_type="application/x-www-form-urlencoded",
+        HTTP_X_SLACK_REQUEST_TIMESTAMP=request_timestamp,
+        HTTP_X_SLACK_SIGNATURE=signature,
+    )
+
+
+def build_button_click(user):
+    """Payload of a click on the notification button"""
+
+    return {
+        "type": "block_actions",
+        "user": {"id": user.slack_userid},
+        "trigger_id": "benchmark_trigger",
+        "actions": [{"type": "button"}],
+    }
+
+
+def build_submission(user, program, work_type):
+    """Payload of a submitted modal, for the first missing slot of the user"""
+
+    missing_time_slot = get_time_slot(user.look_for_data_starting_at, True)
+    if TimeEntry.objects.filter(
+        user=user, date=user.look_for_data_starting_at, is_morning=True
+    ).exists():
+        missing_time_slot += 1
+
+    return {
+        "type": "view_submission",
+        "user": {"id": user.slack_userid},
+        "trigger_id": "benchmark_trigger",
+        "view": {
+            "private_metadata": str(missing_time_slot),
+            "state": {
+                "values": {
+                    "description-block": {
+                        "description-action": {"value": "Benchmark work"}
+                    },
+                    "work-type-block": {
+                        "work-type-action": {
+                            "selected_option": {"value": work_type.slack_value}
+                        }
+                    },
+                    "program-block": {
+                        "program-action": {
+                            "selected_option": {"value": program.slack_value}
+                        }
+                    },
+                }
+            },
+        },
+    }
+
+
+def benchmark_slack_http(command, options, fake_servers):
+    """Slack API calls: one connection per call vs the shared pooled session"""
+
+    iterations = options["iterations"]
+    initial_chat_api_url = settings.config["SLACK_CHAT_API_URL"]
+    with FakeSlackServer(
+        handshake_latency=options["handshake_ms"] / 1000
+    ) as slack_server:
+        settings.config["SLACK_CHAT_API_URL"] = (
+            slack_server.base_url + "/api/chat.postMessage"
+        )
+        query_sender = QuerySender()
+
+        # Previous behavior: module-level requests.post, hence a new connection each time
+        def post_without_session():
+            requests.post(
+                settings.config["SLACK_CHAT_API_URL"],
+                data=json.dumps({"channel": "U0", "text": "benchmark"}),
+                headers=query_sender.default_header,
+            )
+
+        command.report(
+            "slack_http/new_connection_per_call",
+            summarize_durations(measure(post_without_session, iterations)),
+        )
+        command.report(
+            "slack_http/pooled_session",
+            summarize_durations(
+                measure(
+                    lambda: query_sender.send_simple_message("benchmark", "U0"),
+                    iterations,
+                )
+            ),
+        )
+    settings.config["SLACK_CHAT_API_URL"] = initial_chat_api_url
+
+
+def benchmark_db_connections(command, options, fake_servers):
+    """Database connection overhead of a request: new connection, persistent one, pooled one"""
+
+    variants = [
+        ("db_connections/new_connection_per_request", connection.vendor, 0),
+        (
+            "db_connections/persistent_connection",
+            connection.vendor,
+            settings.config["POSTGRES_CONN_MAX_AGE"] or 600,
+        ),
+    ]
+    # Closing a pooled connection gives it back to the pool
+    if connection.vendor == "postgresql":
+        variants.append(("db_connections/pooled_connection", "pooled", 0))
+
+    for name, backend, conn_max_age in variants:
+        settings_dict = dict(
+            connection.settings_dict,
+            CONN_MAX_AGE=conn_max_age,
+            CONN_HEALTH_CHECKS=settings.config["POSTGRES_CONN_HEALTH_CHECKS"],
+        )
+        if backend == "pooled":
+            settings_dict["ENGINE"] = "timesheetbot.db_backends.pooled_postgresql"
+        database_wrapper = load_backend(settings_dict["ENGINE"]).DatabaseWrapper(
+            settings_dict, "benchmark"
+        )
+
+        # As Django does around each request
+        def request():
+            database_wrapper.close_if_unusable_or_obsolete()
+            with database_wrapper.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            database_wrapper.close_if_unusable_or_obsolete()
+
+        command.report(
+            name, summarize_durations(measure(request, options["iterations"]))
+        )
+        database_wrapper.close()
+
+    if connection.vendor == "postgresql":
+        from timesheetbot.db_backends.pooled_postgresql.base import close_pools
+
+        close_pools()
+
+
+def benchmark_handle_slack(command, options, fake_servers):
+    """Webhook answer time, then the deferred handling of clicks & submissions"""
+
+    users = list(User.objects.filter(slack_userid__startswith="UBENCH"))
+    runs = min(options["iterations"], len(users))
+
+    build_any_submission = functools.partial(
+        build_submission,
+        program=Program.objects.filter(is_active=True).first(),
+        work_type=WorkType.objects.filter(is_active=True).first(),
+    )
+
+    # Durable queue: the webhook work is the signature check and a single insert
+    # Submissions are also answered with the next modal, when SLACK_INLINE_NEXT_MODAL is set
+    settings.config["SLACK_HANDLING_MODE"] = "queue"
+    for name, build_payload in (
+        ("handle_slack/webhook_button_click", build_button_click),
+        ("handle_slack/webhook_submission", build_any_submission),
+    ):
+        webhook_request = build_signed_request(build_payload(users[0]))
+        measure_runs(
+            command,
+            name,
+            lambda: handle_slack(webhook_request),
+            options["iterations"],
+            fake_servers,
+        )
+
+    # Each run is a different user, as a notified team would do
+    for name, build_payload in (
+        ("handle_slack/button_click", build_button_click),
+        ("handle_slack/submission", build_any_submission),
+    ):
+        payloads = [build_payload(user) for user in users[:runs]]
+        # Answered inline by the webhook: the handling only stores the submission
+        if (
+            name == "handle_slack/submission"
+            and settings.config["SLACK_INLINE_NEXT_MODAL"]
+        ):
+            for payload in payloads:
+                payload[NEXT_MODAL_SENT_KEY] = True
+        payloads = iter(payloads)
+        measure_runs(
+            command,
+            name,
+            lambda: SlackAnalyzer(next(payloads)).analyze_and_respond(),
+            runs,
+            fake_servers,
+        )
+
+
+def benchmark_hourly_tasks(command, options, fake_servers):
+    """Full hourly run: all synthetic users are due for a notification, all entries to write"""
+
+    def reset():
+        User.objects.update(last_notified="2000-01-01T00:00:00Z")
+        TimeEntry.objects.update(gsheet_written_at=None)
+
+    measure_runs(
+        command,
+        "hourly_tasks",
+        lambda: call_command("perform_hourly_tasks"),
+        options["runs"],
+        fake_servers,
+        reset,
+    )
+
+
+def benchmark_sheet_writer(command, options, fake_servers):
+    """Writing of the whole backlog, then of a few edited entries"""
+
+    measure_runs(
+        command,
+        "sheet_writer/full_backlog",
+        lambda: GoogleSheetWriter().write_all_new_data(),
+        options["runs"],
+        fake_servers,
+        lambda: TimeEntry.objects.update(gsheet_written_at=None),
+    )
+
+    def edit_a_few_entries():
+        for time_entry in TimeEntry.objects.order_by("?")[:10]:
+            time_entry.save()
+
+    measure_runs(
+        command,
+        "sheet_writer/few_edits",
+        lambda: GoogleSheetWriter().write_all_new_data(),
+        options["runs"],
+        fake_servers,
+        edit_a_few_entries,
+    )
+
+
+# Scenarios needing the benchmark environment, which is built once for all of them
+ENVIRONMENT_SCENARIOS = {
+    "db_connections",
+    "handle_slack",
+    "hourly_tasks",
+    "sheet_writer",
+}
+
+SCENARIOS = {
+    "db_connections": benchmark_db_connections,
+    "handle_slack": benchmark_handle_slack,
+    "hourly_tasks": benchmark_hourly_tasks,
+    "sheet_writer": benchmark_sheet_writer,
+    "slack_http": benchmark_slack_http,
+}
+
+
+class Command(BaseCommand):
+    """Django command interface class"""
+
+    help = "Measures hot paths against local fake services"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scenario",
+            type=str,
+            action="append",
+            choices=sorted(SCENARIOS),
+            help="Scenario to run, may be repeated (default: all)",
+        )
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=200,
+            help="Number of measured calls per request-level scenario",
+        )
+        parser.add_argument(
+            "--runs",
+            type=int,
+            default=5,
+            help="Number of measured runs per batch-level scenario",
+        )
+        parser.add_argument(
+            "--users",
+            type=int,
+            default=300,
+            help="Number of synthetic users",
+        )
+        parser.add_argument(
+            "--backlog_days",
+            type=int,
+            default=90,
+            help="Days of synthetic history per user, half of the slots being filled",
+        )
+        parser.add_argument(
+            "--handshake_ms",
+            type=float,
+            default=30,
+            help="Latency of a new connection to fake services, as a TLS handshake would cost",
+        )
+        parser.add_argument(
+            "--latency_ms",
+            type=float,
+            default=5,
+            help="Latency of each call to fake services",
+        )
+        parser.add_argument(
+            "--rate_limit_every",
+            type=int,
+            default=0,
+            help="Fake services answer every n-th call with a 429 (default: never)",
+        )
+
+    def report(self, name, summary):
+        self.stdout.write(format_summary(name, summary))
+
+    def handle(self, *args, **options):
+        """Entrypoint when launched"""
+
+        # Per-entry logs would bury the reports
+        logging.disable(logging.INFO)
+
+        scenarios = options["scenario"] or sorted(SCENARIOS)
+        if ENVIRONMENT_SCENARIOS.intersection(scenarios):
+            environment = benchmark_environment(options)
+        else:
+            environment = contextlib.nullcontext()
+
+        with environment as fake_servers:
+            for scenario in scenarios:
+                SCENARIOS[scenario](self, options, fake_servers)
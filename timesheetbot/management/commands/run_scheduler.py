@@ -0,0 +1,23 @@
+import signal
+import threading
+
+from timesheetbot.utils.scheduler import Scheduler
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    """Django command interface class"""
+
+    help = (
+        "Continuously performs notification/writing tasks, replacing the hourly tasks"
+    )
+
+    def handle(self, *args, **options):
+        """Entrypoint when launched"""
+
+        # Stop gracefully: the current step is completed
+        stop_event = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+        signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+
+        Scheduler().run(stop_event)
@@ -0,0 +1,38 @@
+# Generated by Django 4.2 on 2026-10-18 20:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("timesheetbot", "0010_remove_user_do_send_copy_of_data"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SlackJob",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("payload", models.JSONField()),
+                ("status", models.CharField(default="pending", max_length=15)),
+                ("attempts", models.IntegerField(default=0)),
+                ("error", models.TextField(blank=True, default="")),
+                ("creation_time", models.DateTimeField(auto_now_add=True)),
+                ("start_time", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="slackjob",
+            index=models.Index(
+                fields=["status", "id"], name="timesheetbo_status_c55d2c_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2 on 2026-10-18 20:16
+
+from django.db import migrations, models
+
+
+def flag_to_writing_time(apps, schema_editor):
+    """Entries already written are considered written when they were last modified"""
+
+    TimeEntry = apps.get_model("timesheetbot", "TimeEntry")
+    TimeEntry.objects.filter(has_been_written_in_gsheet=True).update(
+        gsheet_written_at=models.F("modification_time")
+    )
+
+
+def writing_time_to_flag(apps, schema_editor):
+    TimeEntry = apps.get_model("timesheetbot", "TimeEntry")
+    TimeEntry.objects.filter(gsheet_written_at__isnull=False).update(
+        has_been_written_in_gsheet=True
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("timesheetbot", "0011_slackjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="timeentry",
+            name="gsheet_written_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(flag_to_writing_time, writing_time_to_flag),
+        migrations.RemoveField(
+            model_name="timeentry",
+            name="has_been_written_in_gsheet",
+        ),
+    ]
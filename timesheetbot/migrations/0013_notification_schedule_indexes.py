@@ -0,0 +1,24 @@
+# Generated by Django 4.2 on 2026-10-18 20:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("timesheetbot", "0012_timeentry_gsheet_written_at"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="notificationhour",
+            index=models.Index(
+                fields=["timezone_hour"], name="timesheetbo_timezon_444599_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="user",
+            index=models.Index(
+                fields=["working_timezone"], name="timesheetbo_working_23bc34_idx"
+            ),
+        ),
+    ]
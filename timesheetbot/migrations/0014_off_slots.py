@@ -0,0 +1,56 @@
+# Generated by Django 4.2 on 2026-10-18 20:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("timesheetbot", "0013_notification_schedule_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OffSlotSync",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("sheet_title", models.CharField(max_length=63, unique=True)),
+                ("spreadsheet_modified_time", models.CharField(max_length=63)),
+                ("sync_time", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="OffSlot",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("is_morning", models.BooleanField()),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="timesheetbot.user",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("user", "date", "is_morning")},
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2 on 2026-10-18 20:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("timesheetbot", "0014_off_slots"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserSlotSummary",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("analysis_start", models.DateField()),
+                ("needed_until_time_slot", models.IntegerField()),
+                ("missing_time_slots", models.JSONField(default=list)),
+                ("missing_count", models.IntegerField(default=0)),
+                ("first_missing_time_slot", models.IntegerField(blank=True, null=True)),
+                ("last_filled_time_slot", models.IntegerField(blank=True, null=True)),
+                ("update_time", models.DateTimeField(auto_now=True)),
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="timesheetbot.user",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2 on 2026-10-18 20:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("timesheetbot", "0015_user_slot_summary"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="timeentry",
+            index=models.Index(
+                condition=models.Q(
+                    models.Q(
+                        ("gsheet_written_at__isnull", True),
+                        ("modification_time__gt", models.F("gsheet_written_at")),
+                        _connector="OR",
+                    ),
+                    ("program__isnull", False),
+                ),
+                fields=["date"],
+                name="timeentry_pending_write_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="timeentry",
+            index=models.Index(
+                condition=models.Q(("program__isnull", False)),
+                fields=["user", "date"],
+                include=("is_morning",),
+                name="timeentry_user_filled_idx",
+            ),
+        ),
+    ]
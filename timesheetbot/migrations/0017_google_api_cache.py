@@ -0,0 +1,30 @@
+# Generated by Django 4.2 on 2026-10-18 20:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("timesheetbot", "0016_time_entry_query_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GoogleApiCache",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=63, unique=True)),
+                ("version", models.CharField(max_length=255)),
+                ("value", models.JSONField()),
+                ("update_time", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-18 21:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("timesheetbot", "0017_google_api_cache"),
+    ]
+
+    operations = [
+        # Existing off-slots were all read from the sheet; new ones are manual by default
+        migrations.AddField(
+            model_name="offslot",
+            name="source",
+            field=models.CharField(default="sheet", max_length=15),
+        ),
+        migrations.AlterField(
+            model_name="offslot",
+            name="source",
+            field=models.CharField(default="manual", max_length=15),
+        ),
+    ]
@@ -10,6 +10,11 @@ class User(models.Model):
     last_notified = models.DateTimeField()
     working_timezone = models.CharField(max_length=31, unique=False, default="CET")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["working_timezone"]),
+        ]
+
     def __str__(self):
         return "<User: {}>".format(self.first_name)
 
@@ -44,7 +49,8 @@ class TimeEntry(models.Model):
     work_type = models.ForeignKey(WorkType, on_delete=models.SET_NULL, null=True)
     creation_time = models.DateTimeField(auto_now_add=True, blank=False, null=False)
     modification_time = models.DateTimeField(auto_now=True, blank=False, null=False)
-    has_been_written_in_gsheet = models.BooleanField(null=False, default=False)
+    # Entries modified after their latest writing must be written again
+    gsheet_written_at = models.DateTimeField(blank=True, null=True)
 
     class Meta:
         unique_together = (
@@ -52,6 +58,25 @@ class TimeEntry(models.Model):
             "date",
             "is_morning",
         )
+        indexes = [
+            # Entries pending a write to the sheet are few: the writer scans them by date
+            models.Index(
+                fields=["date"],
+                name="timeentry_pending_write_idx",
+                condition=(
+                    models.Q(gsheet_written_at__isnull=True)
+                    | models.Q(modification_time__gt=models.F("gsheet_written_at"))
+                )
+                & models.Q(program__isnull=False),
+            ),
+            # Filled slots of users from a date, answered from the index alone
+            models.Index(
+                fields=["user", "date"],
+                name="timeentry_user_filled_idx",
+                include=["is_morning"],
+                condition=models.Q(program__isnull=False),
+            ),
+        ]
 
     def __str__(self):
         return (
@@ -70,6 +95,118 @@ class NotificationHour(models.Model):
             "user",
             "timezone_hour",
         )
+        # Due users are looked up by hour
+        indexes = [
+            models.Index(fields=["timezone_hour"]),
+        ]
 
     def __str__(self):
         return "<NotificationHour: {} at {}>".format(self.user, self.timezone_hour)
+
+
+class OffSlot(models.Model):
+    """Half-day marked as not worked (vacation, holiday...) by a colored background in the sheet, or by hand"""
+
+    # Read from the sheet, hence replaced by its next reading; or entered in the admin, and kept
+    SOURCE_SHEET = "sheet"
+    SOURCE_MANUAL = "manual"
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    date = models.DateField(blank=False, null=False)
+    is_morning = models.BooleanField(null=False)
+    source = models.CharField(max_length=15, default=SOURCE_MANUAL)
+
+    class Meta:
+        unique_together = (
+            "user",
+            "date",
+            "is_morning",
+        )
+
+    def __str__(self):
+        return (
+            "<OffSlot: {}/{}/".format(self.user, self.date)
+            + ("morning" if self.is_morning else "afternoon")
+            + ">"
+        )
+
+
+class OffSlotSync(models.Model):
+    """Version of the spreadsheet when off-slots of a weekly sheet were last read"""
+
+    sheet_title = models.CharField(max_length=63, unique=True)
+    # Moved forward by the bot's own writes, which leave off-slots unchanged
+    spreadsheet_modified_time = models.CharField(max_length=63)
+    # Last actual reading
+    sync_time = models.DateTimeField(auto_now=True, blank=False, null=False)
+
+    def __str__(self):
+        return "<OffSlotSync: {} ({})>".format(
+            self.sheet_title, self.spreadsheet_modified_time
+        )
+
+
+class TaskRun(models.Model):
+    """Last run of a periodic task, shared by the processes which may run it"""
+
+    name = models.CharField(max_length=63, unique=True)
+    # Empty until the task first ran
+    run_time = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return "<TaskRun: {} ({})>".format(self.name, self.run_time)
+
+
+class GoogleApiCache(models.Model):
+    """Google API answer reused across runs while its version is current; secrets are stored encrypted"""
+
+    key = models.CharField(max_length=63, unique=True)
+    # e.g. service account of an access token
+    version = models.CharField(max_length=255)
+    value = models.JSONField()
+    update_time = models.DateTimeField(auto_now=True, blank=False, null=False)
+
+    def __str__(self):
+        return "<GoogleApiCache: {} ({})>".format(self.key, self.version)
+
+
+class UserSlotSummary(models.Model):
+    """Missing time slots of a user, maintained as entries are filled and as time passes"""
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE)
+    # User's analysis starting point when the summary was computed
+    analysis_start = models.DateField()
+    # Time slots before this one are accounted for
+    needed_until_time_slot = models.IntegerField()
+    # Sorted
+    missing_time_slots = models.JSONField(default=list)
+    missing_count = models.IntegerField(default=0)
+    first_missing_time_slot = models.IntegerField(blank=True, null=True)
+    last_filled_time_slot = models.IntegerField(blank=True, null=True)
+    update_time = models.DateTimeField(auto_now=True, blank=False, null=False)
+
+    def __str__(self):
+        return "<UserSlotSummary: {} ({} missing)>".format(
+            self.user, self.missing_count
+        )
+
+
+class SlackJob(models.Model):
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_FAILED = "failed"
+
+    payload = models.JSONField()
+    status = models.CharField(max_length=15, default=STATUS_PENDING)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True, null=False, default="")
+    creation_time = models.DateTimeField(auto_now_add=True, blank=False, null=False)
+    start_time = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "id"]),
+        ]
+
+    def __str__(self):
+        return "<SlackJob: {} ({})>".format(self.pk, self.status)
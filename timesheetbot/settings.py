@@ -4,29 +4,81 @@ import yaml
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# Environment variables override the defaults, with these types
+INT_CONFIG_KEYS = frozenset(
+    [
+        "AFTERNOON_ENDS_AT",
+        "GSPREAD_BURST_REQUESTS",
+        "GSPREAD_MAX_RETRIES",
+        "GSPREAD_REQUESTS_PER_MINUTE",
+        "METRICS_PORT",
+        "MINDATE_MAINTENANCE_UTC_HOUR",
+        "MORNING_ENDS_AT",
+        "OFF_SLOT_SYNC_MAX_AGE_HOURS",
+        "POSTGRES_CONN_MAX_AGE",
+        "POSTGRES_POOL_SIZE",
+        "POSTGRES_SERVICE_PORT",
+        "SCHEDULER_POLL_SECONDS",
+        "SCHEDULER_REFRESH_SECONDS",
+        "SCHEDULER_SHEET_BACKOFF_SECONDS",
+        "SCHEDULER_SHEET_DEBOUNCE_SECONDS",
+        "SCHEDULER_SHEET_MAX_BACKOFF_SECONDS",
+        "SCHEDULER_SHEET_MAX_DELAY_SECONDS",
+        "SLACK_HTTP_POOL_SIZE",
+        "SLACK_HTTP_RETRIES",
+        "SLACK_HTTP_TIMEOUT_SECONDS",
+        "SLACK_JOB_BATCH_SIZE",
+        "SLACK_JOB_CONSUMERS",
+        "SLACK_JOB_MAX_ATTEMPTS",
+        "SLACK_JOB_POLL_INTERVAL_SECONDS",
+        "SLACK_JOB_REPORT_INTERVAL_SECONDS",
+        "SLACK_JOB_RETENTION_DAYS",
+        "SLACK_JOB_STALE_AFTER_SECONDS",
+        "SLACK_NOTIFICATION_CONCURRENCY",
+        "SLACK_OPTIONS_CACHE_TTL_SECONDS",
+        "SLACK_QUERY_MAX_AGE_SECONDS",
+        "SLACK_RATE_LIMIT_MAX_RETRIES",
+        "SLACK_WORKER_QUEUE_SIZE",
+        "SLACK_WORKER_QUEUE_TIMEOUT_SECONDS",
+        "SLACK_WORKER_THREADS",
+        "SPREADSHEET_BATCH_MAX_RANGES",
+        "SPREADSHEET_QUERY_CHUNK_SIZE",
+    ]
+)
+BOOL_CONFIG_KEYS = frozenset(
+    [
+        "DJANGO_DEBUG_MODE",
+        "POSTGRES_CONN_HEALTH_CHECKS",
+        "SKIP_NOTIFICATIONS_ON_WE",
+        "SLACK_INLINE_NEXT_MODAL",
+    ]
+)
+FLOAT_CONFIG_KEYS = frozenset(
+    [
+        "GSPREAD_BACKOFF_SECONDS",
+        "GSPREAD_MAX_BACKOFF_SECONDS",
+        "SLACK_HTTP_BACKOFF_FACTOR",
+    ]
+)
+
+# Every process parses the configuration: the C parser is much faster, when libyaml is available
 with open(os.path.join(BASE_DIR, "default_config.yaml"), "r") as hr:
-    config = yaml.load(hr, Loader=yaml.FullLoader)
-
-for config_key in config:
-    if config_key in os.environ:
-        if config_key in set(
-            [
-                "AFTERNOON_ENDS_AT",
-                "MORNING_ENDS_AT",
-                "POSTGRES_SERVICE_PORT",
-                "SLACK_QUERY_MAX_AGE_SECONDS",
-            ]
-        ):
-            config[config_key] = int(os.environ[config_key])
-        elif config_key in set(["DJANGO_DEBUG_MODE", "SKIP_NOTIFICATIONS_ON_WE"]):
-            config[config_key] = os.environ[config_key].lower() not in (
-                "",
-                "false",
-                "0",
-                "f",
-            )
-        else:
-            config[config_key] = os.environ[config_key]
+    config = yaml.load(hr, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+
+for config_key in config.keys() & os.environ.keys():
+    if config_key in INT_CONFIG_KEYS:
+        config[config_key] = int(os.environ[config_key])
+    elif config_key in BOOL_CONFIG_KEYS:
+        config[config_key] = os.environ[config_key].lower() not in (
+            "",
+            "false",
+            "0",
+            "f",
+        )
+    elif config_key in FLOAT_CONFIG_KEYS:
+        config[config_key] = float(os.environ[config_key])
+    else:
+        config[config_key] = os.environ[config_key]
 
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = config["DJANGO_SECURITY_KEY"]
@@ -97,14 +149,20 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "wsgi.application"
 
+# Connections are kept open between requests, and checked before being reused
+# With a pool size, connections closed by Django go back to a process-wide pool instead
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql",
+        "ENGINE": "timesheetbot.db_backends.pooled_postgresql"
+        if config["POSTGRES_POOL_SIZE"]
+        else "django.db.backends.postgresql",
         "NAME": config["POSTGRES_NAME"],
         "USER": config["POSTGRES_USER"],
         "PASSWORD": config["POSTGRES_PASSWORD"],
         "HOST": config["POSTGRES_SERVICE_HOST"],
         "PORT": config["POSTGRES_SERVICE_PORT"],
+        "CONN_MAX_AGE": config["POSTGRES_CONN_MAX_AGE"],
+        "CONN_HEALTH_CHECKS": config["POSTGRES_CONN_HEALTH_CHECKS"],
     }
 }
 
@@ -0,0 +1,108 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+
+from .models import OffSlot, Program, TimeEntry, WorkType
+from .utils.payload_cache import invalidate_options_cache
+from .utils.slot_summary import forget_slot_summaries, mark_time_slots_filled
+from .utils.time_slot import get_time_slot
+
+# Slack options lists are cached, hence must be rebuilt when their sources change
+for sender in (Program, WorkType):
+    post_save.connect(invalidate_options_cache, sender=sender)
+    post_delete.connect(invalidate_options_cache, sender=sender)
+
+
+def remember_previous_time_slot(sender, instance, raw=False, **kwargs):
+    """Remembers the user & time slot of a row before its update, which may move it"""
+
+    instance.previous_time_slot = None
+    if raw or instance.pk is None:
+        return
+
+    previous = (
+        sender.objects.filter(pk=instance.pk)
+        .values("user_id", "date", "is_morning")
+        .first()
+    )
+    if previous is not None:
+        instance.previous_time_slot = (
+            previous["user_id"],
+            get_time_slot(previous["date"], previous["is_morning"]),
+        )
+
+
+def get_moved_user_ids(instance):
+    """User whose time slot a row left when updated, if it moved"""
+
+    previous_time_slot = getattr(instance, "previous_time_slot", None)
+    if previous_time_slot is None or previous_time_slot == (
+        instance.user_id,
+        get_time_slot(instance.date, instance.is_morning),
+    ):
+        return []
+
+    return [previous_time_slot[0]]
+
+
+def update_slot_summary(sender, instance, created, raw=False, **kwargs):
+    """A filled entry is not missing anymore; an entry may have been emptied or moved otherwise"""
+
+    if raw:
+        return
+
+    # The slot left behind may be missing again
+    moved_user_ids = get_moved_user_ids(instance)
+    if len(moved_user_ids):
+        forget_slot_summaries(moved_user_ids)
+
+    if instance.program_id is not None:
+        mark_time_slots_filled(
+            instance.user_id, [get_time_slot(instance.date, instance.is_morning)]
+        )
+    elif not created:
+        forget_slot_summaries([instance.user_id])
+
+
+def forget_slot_summary(sender, instance, **kwargs):
+    """A deleted entry may be missing again"""
+
+    forget_slot_summaries([instance.user_id])
+
+
+def forget_off_slot_summaries(sender, instance, raw=False, **kwargs):
+    """A created, moved or deleted off-slot changes the missing slots of its users"""
+
+    if raw:
+        return
+
+    forget_slot_summaries([instance.user_id] + get_moved_user_ids(instance))
+
+
+# Entry field referencing each model
+ENTRY_FIELD_NAMES = {Program: "program", WorkType: "work_type"}
+
+
+def forget_emptied_entries_summaries(sender, instance, **kwargs):
+    """Entries lose their deleted program or work type without any signal: their users are computed again"""
+
+    forget_slot_summaries(
+        list(
+            TimeEntry.objects.filter(**{ENTRY_FIELD_NAMES[sender]: instance})
+            .values_list("user_id", flat=True)
+            .distinct()
+        )
+    )
+
+
+# Missing slots summaries follow entries changes; bulk statements must update them explicitly
+pre_save.connect(remember_previous_time_slot, sender=TimeEntry)
+post_save.connect(update_slot_summary, sender=TimeEntry)
+post_delete.connect(forget_slot_summary, sender=TimeEntry)
+
+# Off-slots edited by hand; the off-slot reader updates summaries itself
+pre_save.connect(remember_previous_time_slot, sender=OffSlot)
+post_save.connect(forget_off_slot_summaries, sender=OffSlot)
+post_delete.connect(forget_off_slot_summaries, sender=OffSlot)
+
+# Entries are emptied by the deletion (SET_NULL), so their users are listed before
+for sender in ENTRY_FIELD_NAMES:
+    pre_delete.connect(forget_emptied_entries_summaries, sender=sender)
@@ -0,0 +1,77 @@
+import datetime
+import unittest
+
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+from timesheetbot.models import OffSlot, TimeEntry, User
+from timesheetbot.utils.benchmark import create_synthetic_data
+from timesheetbot.utils.google_sheet_writer import get_time_entries_to_write
+
+# Years of synthetic history: planners only prefer indexes on tables of a realistic size
+SEED_USERS = 100
+SEED_BACKLOG_DAYS = 730
+# Entries left to write to the sheet, nearly all being written
+SEED_PENDING_ENTRIES = 50
+
+
+@unittest.skipUnless(
+    connection.vendor == "postgresql", "Query plans are checked on PostgreSQL"
+)
+class QueryPlanTests(TestCase):
+    """Hot queries use their indexes, rather than scanning whole tables"""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_synthetic_data(SEED_USERS, SEED_BACKLOG_DAYS)
+        TimeEntry.objects.update(gsheet_written_at=timezone.now())
+        TimeEntry.objects.filter(
+            pk__in=TimeEntry.objects.order_by("?").values("pk")[:SEED_PENDING_ENTRIES]
+        ).update(gsheet_written_at=None)
+
+        # Planners choose from table statistics
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+        cls.user = User.objects.order_by("pk").first()
+        cls.first_date = datetime.date.today() - datetime.timedelta(days=30)
+
+    def assertUsesIndex(self, queryset, model, index_name=None):
+        """Checks the plan of a query: no full scan of the model's table, and the given index used if any"""
+
+        plan = queryset.explain()
+        self.assertNotIn(f"Seq Scan on {model._meta.db_table}", plan)
+        if index_name is not None:
+            self.assertIn(index_name, plan)
+
+    def test_pending_writes(self):
+        """Sheet writer: entries to write, by date"""
+
+        self.assertUsesIndex(
+            get_time_entries_to_write().order_by("date"),
+            TimeEntry,
+            "timeentry_pending_write_idx",
+        )
+
+    def test_filled_time_slots(self):
+        """Missing slots analysis: filled slots of a user from a date"""
+
+        self.assertUsesIndex(
+            TimeEntry.objects.filter(
+                program__isnull=False,
+                date__gte=self.first_date,
+                user_id__in=[self.user.pk],
+            ).values("user_id", "date", "is_morning"),
+            TimeEntry,
+            "timeentry_user_filled_idx",
+        )
+
+    def test_off_time_slots(self):
+        """Missing slots analysis: days off of a user from a date"""
+
+        self.assertUsesIndex(
+            OffSlot.objects.filter(
+                date__gte=self.first_date, user_id__in=[self.user.pk]
+            ).values("user_id", "date", "is_morning"),
+            OffSlot,
+        )
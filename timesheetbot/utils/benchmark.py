@@ -0,0 +1,105 @@
+import datetime
+import random
+import statistics
+import time
+
+from timesheetbot.models import NotificationHour, Program, TimeEntry, User, WorkType
+
+
+def measure(function, iterations):
+    """Calls `function` `iterations` times, returns the durations in milliseconds"""
+
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        durations.append((time.perf_counter() - start) * 1000)
+
+    return durations
+
+
+def summarize_durations(durations):
+    """Returns mean/percentiles of a list of durations"""
+
+    sorted_durations = sorted(durations)
+
+    def percentile(ratio):
+        return sorted_durations[
+            min(len(sorted_durations) - 1, int(ratio * len(sorted_durations)))
+        ]
+
+    return {
+        "count": len(durations),
+        "mean_ms": statistics.mean(durations),
+        "p50_ms": percentile(0.5),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": sorted_durations[-1],
+    }
+
+
+def format_summary(name, summary):
+    """One line report of a summary"""
+
+    return f"{name:<40} " + " ".join(
+        f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+        for key, value in summary.items()
+    )
+
+
+def create_synthetic_data(user_count, backlog_days, fill_ratio=0.5, seed=0):
+    """Creates users behind on their timesheets for `backlog_days`, due for notification at any hour"""
+
+    randomizer = random.Random(seed)
+
+    # Reference data are seeded by migrations
+    programs = list(Program.objects.filter(is_active=True))
+    work_types = list(WorkType.objects.filter(is_active=True))
+    start_date = datetime.date.today() - datetime.timedelta(days=backlog_days)
+
+    User.objects.bulk_create(
+        [
+            User(
+                first_name=f"Benchmark {user_num}",
+                slack_userid=f"UBENCH{user_num}",
+                spreadsheet_top_row=2 + user_num * 12,
+                look_for_data_starting_at=start_date,
+                last_notified=datetime.datetime(
+                    2000, 1, 1, tzinfo=datetime.timezone.utc
+                ),
+            )
+            for user_num in range(user_count)
+        ]
+    )
+    users = list(User.objects.filter(slack_userid__startswith="UBENCH"))
+
+    NotificationHour.objects.bulk_create(
+        [
+            NotificationHour(user=user, timezone_hour=hour)
+            for user in users
+            for hour in range(24)
+        ]
+    )
+
+    time_entries = []
+    for user in users:
+        for day_num in range(backlog_days):
+            date = start_date + datetime.timedelta(days=day_num)
+            if date.weekday() >= 5:
+                continue
+            for is_morning in (True, False):
+                if randomizer.random() < fill_ratio:
+                    time_entries.append(
+                        TimeEntry(
+                            user=user,
+                            description=f"Synthetic work {day_num}",
+                            date=date,
+                            is_morning=is_morning,
+                            is_afternoon=not is_morning,
+                            program=randomizer.choice(programs),
+                            work_type=randomizer.choice(work_types),
+                        )
+                    )
+    TimeEntry.objects.bulk_create(time_entries, batch_size=1000)
+
+    return users
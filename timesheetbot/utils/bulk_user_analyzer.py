@@ -0,0 +1,157 @@
+import datetime
+import pytz
+import timesheetbot.settings as settings
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from timesheetbot.models import NotificationHour, TaskRun, User
+from timesheetbot.utils.query_sender import QuerySender
+from timesheetbot.utils.slot_summary import (
+    get_slot_summaries,
+    move_analysis_start,
+    save_moved_analysis_starts,
+)
+from timesheetbot.utils.user_analyzer import can_be_notified, compute_analysis_mindate
+
+MINDATE_MAINTENANCE_TASK = "mindate_maintenance"
+
+
+def get_users_due_for_notification(current_time=None):
+    """Users having a notification hour now, in their own timezone (hence DST-aware)"""
+
+    current_time = current_time or timezone.now()
+
+    # Users share a handful of timezones: one condition per timezone, a single query
+    due_hours = Q()
+    for working_timezone in (
+        User.objects.order_by().values_list("working_timezone", flat=True).distinct()
+    ):
+        due_hours |= Q(
+            working_timezone=working_timezone,
+            notificationhour__timezone_hour=current_time.astimezone(
+                pytz.timezone(working_timezone)
+            ).hour,
+        )
+
+    if not due_hours:
+        return User.objects.none()
+
+    return User.objects.filter(due_hours)
+
+
+class BulkUserAnalyzer:
+    """Class to handle the periodic tasks of many users at once, with a constant number of queries"""
+
+    def __init__(self, users=None):
+        """Loads users (all of them by default), their notification hours and missing timeslots"""
+
+        self.query_sender = QuerySender()
+        self.users = list(users if users is not None else User.objects.all())
+
+        # Related rows are restricted to the loaded users, unless everyone is
+        related_filter = {} if users is None else {"user__in": self.users}
+
+        self.notification_hours = defaultdict(set)
+        for one_hour in NotificationHour.objects.filter(**related_filter).values(
+            "user_id", "timezone_hour"
+        ):
+            self.notification_hours[one_hour["user_id"]].add(one_hour["timezone_hour"])
+
+        # Missing slots are maintained per user: only rolled over if time passed
+        self.slot_summaries = get_slot_summaries(self.users)
+        self.moved_slot_summaries = []
+
+    def launch_notifications(self):
+        """Launch notifications inviting users to fill their missing entries"""
+
+        # First decide who must be notified...
+        notifications = []
+        for user in self.users:
+            current_tz_time = datetime.datetime.now(
+                tz=pytz.timezone(user.working_timezone)
+            )
+
+            # Notifications can be sent only at configured hours for each user
+            if current_tz_time.hour not in self.notification_hours[user.pk]:
+                continue
+
+            count_missing_data = self.slot_summaries[user.pk].missing_count
+            if can_be_notified(user, count_missing_data, current_tz_time):
+                notifications.append((user, count_missing_data, current_tz_time))
+
+        # ... then send concurrently, so that a slow answer doesn't delay everyone
+        with ThreadPoolExecutor(
+            max_workers=settings.config["SLACK_NOTIFICATION_CONCURRENCY"]
+        ) as executor:
+            sent_flags = executor.map(
+                lambda notification: self.query_sender.prepare_and_send_notification(
+                    notification[0], notification[1]
+                ),
+                notifications,
+            )
+
+            # Only users who actually received their notification are considered notified
+            for (user, _, current_tz_time), is_sent in zip(notifications, sent_flags):
+                if is_sent:
+                    user.last_notified = current_tz_time
+
+    def update_users_analysis_mindate(self):
+        """Updates the starting point for missing data analysis of all users"""
+
+        for user in self.users:
+            summary = self.slot_summaries[user.pk]
+            user.look_for_data_starting_at = compute_analysis_mindate(
+                summary.first_missing_time_slot
+            )
+            # Summaries follow, so that they are not built again
+            if summary.analysis_start != user.look_for_data_starting_at:
+                move_analysis_start(summary, user.look_for_data_starting_at)
+                self.moved_slot_summaries.append(summary)
+
+    def save(self):
+        """Writes back all users changes at once"""
+
+        User.objects.bulk_update(
+            self.users, ["look_for_data_starting_at", "last_notified"]
+        )
+        save_moved_analysis_starts(self.moved_slot_summaries)
+
+
+def get_last_maintenance_schedule(current_time):
+    """Latest time maintenance was scheduled at, today or yesterday"""
+
+    scheduled_time = current_time.replace(
+        hour=settings.config["MINDATE_MAINTENANCE_UTC_HOUR"],
+        minute=0,
+        second=0,
+        microsecond=0,
+    )
+    if scheduled_time > current_time:
+        scheduled_time -= datetime.timedelta(days=1)
+    return scheduled_time
+
+
+def maintain_users_analysis_mindate(current_time=None):
+    """Once a day, moves forward analysis startpoints of everyone; a missed hour is caught up by the next run"""
+
+    current_time = current_time or timezone.now()
+    with transaction.atomic():
+        # Locked, so that concurrent runs do not maintain twice
+        task_run, _ = TaskRun.objects.select_for_update().get_or_create(
+            name=MINDATE_MAINTENANCE_TASK, defaults={"run_time": None}
+        )
+        if (
+            task_run.run_time is not None
+            and task_run.run_time >= get_last_maintenance_schedule(current_time)
+        ):
+            return False
+
+        bulk_user_analyzer = BulkUserAnalyzer()
+        bulk_user_analyzer.update_users_analysis_mindate()
+        bulk_user_analyzer.save()
+        task_run.run_time = current_time
+        task_run.save()
+    return True
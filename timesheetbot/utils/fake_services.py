@@ -0,0 +1,334 @@
+import datetime
+import json
+import re
+import requests
+import threading
+import time
+import urllib.parse
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeApiRequestHandler(BaseHTTPRequestHandler):
+    """Delegates every call to the server, which knows the emulated API"""
+
+    # Keep-alive, as real APIs; without Nagle, small responses are not delayed
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        """New connection: emulates the TLS handshake cost of the real API"""
+
+        super().setup()
+        time.sleep(self.server.handshake_latency)
+
+    def do_GET(self):
+        self.handle_api_call("GET")
+
+    def do_POST(self):
+        self.handle_api_call("POST")
+
+    def do_PUT(self):
+        self.handle_api_call("PUT")
+
+    def handle_api_call(self, method):
+        """Reads the request, lets the server answer it, sends the answer back"""
+
+        raw_body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        request_body = json.loads(raw_body) if raw_body else None
+
+        url = urllib.parse.urlsplit(self.path)
+        status, response_body, headers = self.server.answer(
+            method, url.path, request_body, urllib.parse.parse_qs(url.query)
+        )
+
+        body = json.dumps(response_body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for header_name, header_value in headers.items():
+            self.send_header(header_name, header_value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Silenced: benchmarks would otherwise drown in access logs"""
+
+
+class FakeApiServer(ThreadingHTTPServer):
+    """Local stand-in for a web API, served from a background thread
+
+    Latencies are in seconds. If rate_limit_every is set, every n-th call is answered with a 429.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, handshake_latency=0.0, latency=0.0, rate_limit_every=0):
+        """Listens on a free local port"""
+
+        super().__init__(("127.0.0.1", 0), FakeApiRequestHandler)
+        self.handshake_latency = handshake_latency
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.lock = threading.Lock()
+        self.reset_counts()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    @property
+    def total_request_count(self):
+        return sum(self.request_counts.values())
+
+    def reset_counts(self):
+        """Forgets about past calls"""
+
+        with self.lock:
+            self.request_counts = {}
+            self.rate_limited_count = 0
+            self.call_num = 0
+
+    def answer(self, method, path, request_body, query=None):
+        """Counts the call, applies latency and rate limiting, then answers it"""
+
+        api_method = self.get_api_method(method, path)
+        with self.lock:
+            self.request_counts[api_method] = self.request_counts.get(api_method, 0) + 1
+            self.call_num += 1
+            is_rate_limited = (
+                self.rate_limit_every and self.call_num % self.rate_limit_every == 0
+            )
+            if is_rate_limited:
+                self.rate_limited_count += 1
+
+        time.sleep(self.latency)
+        if is_rate_limited:
+            return 429, self.get_rate_limited_body(), {"Retry-After": "1"}
+
+        with self.lock:
+            return self.answer_api_call(api_method, path, request_body, query or {})
+
+    def get_api_method(self, method, path):
+        """Name of the called API method, used to count calls"""
+
+        return f"{method} {path}"
+
+    def get_rate_limited_body(self):
+        return {}
+
+    def answer_api_call(self, api_method, path, request_body, query):
+        """Returns status, body and headers of the answer; query values are lists
+
+        Calls not emulated by a fake service are answered as unknown.
+        """
+
+        return 404, {"error": {"code": 404, "message": "Not emulated"}}, {}
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeSlackServer(FakeApiServer):
+    """Answers any Slack API call as a success"""
+
+    def get_api_method(self, method, path):
+        return path.rsplit("/", 1)[-1]
+
+    def get_rate_limited_body(self):
+        return {"ok": False, "error": "ratelimited"}
+
+    def answer_api_call(self, api_method, path, request_body, query):
+        return 200, {"ok": True}, {}
+
+
+class FakeSheetsServer(FakeApiServer):
+    """Emulates the parts of Google Sheets & Drive APIs used by the sheet writer/reader, for any spreadsheet id
+
+    Rows listed in off_rows (sheet title => row numbers) have a colored background.
+    """
+
+    SPREADSHEET_PATH_PATTERN = re.compile(r"^/v4/spreadsheets/([^/:]+)(.*)$")
+    DRIVE_FILE_PATH_PATTERN = re.compile(r"^/drive/v3/files/([^/]+)$")
+    GRID_RANGE_PATTERN = re.compile(r"^'?(.*?)'?![A-Z]+(\d+):[A-Z]+(\d+)$")
+
+    def __init__(self, sheet_titles=("Template",), **kwargs):
+        """The spreadsheet starts with the given sheets"""
+
+        super().__init__(**kwargs)
+        self.sheets = [
+            {"sheetId": sheet_num, "title": sheet_title, "index": sheet_num}
+            for sheet_num, sheet_title in enumerate(sheet_titles)
+        ]
+        self.written_ranges = {}
+        self.off_rows = {}
+        # Bumped by each change, as Drive's modifiedTime
+        self.version = 0
+
+    @property
+    def modified_time(self):
+        return (
+            datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+            + datetime.timedelta(seconds=self.version)
+        ).isoformat()
+
+    def set_off_rows(self, sheet_title, rows):
+        """Colors the background of some rows of a sheet"""
+
+        with self.lock:
+            self.off_rows[sheet_title] = set(rows)
+            self.version += 1
+
+    def get_api_method(self, method, path):
+        if self.DRIVE_FILE_PATH_PATTERN.match(path):
+            return "drive.files.get"
+
+        match = self.SPREADSHEET_PATH_PATTERN.match(path)
+        if match is None:
+            return f"{method} {path}"
+
+        suffix = match[2]
+        if suffix == "":
+            return "spreadsheets.get"
+        if suffix == ":batchUpdate":
+            return "spreadsheets.batchUpdate"
+        if suffix == "/values:batchUpdate":
+            return "values.batchUpdate"
+        if suffix.startswith("/values/"):
+            return "values.update"
+
+        return f"{method} {path}"
+
+    def get_rate_limited_body(self):
+        return {
+            "error": {
+                "code": 429,
+                "message": "Quota exceeded",
+                "status": "RESOURCE_EXHAUSTED",
+            }
+        }
+
+    def build_grid_data(self, ranges):
+        """Background colors of the given single-column ranges, per sheet"""
+
+        white = {"red": 1, "green": 1, "blue": 1}
+        grey = {"red": 0.8, "green": 0.8, "blue": 0.8}
+        sheets = []
+        for one_range in ranges:
+            sheet_title, first_row, last_row = self.GRID_RANGE_PATTERN.match(
+                one_range
+            ).groups()
+            if sheet_title not in [sheet["title"] for sheet in self.sheets]:
+                return None
+            off_rows = self.off_rows.get(sheet_title, set())
+            sheets.append(
+                {
+                    "properties": {"title": sheet_title},
+                    "data": [
+                        {
+                            "startRow": int(first_row) - 1,
+                            "rowData": [
+                                {
+                                    "values": [
+                                        {
+                                            "effectiveFormat": {
+                                                "backgroundColor": grey
+                                                if row in off_rows
+                                                else white
+                                            }
+                                        }
+                                    ]
+                                }
+                                for row in range(int(first_row), int(last_row) + 1)
+                            ],
+                        }
+                    ],
+                }
+            )
+
+        return sheets
+
+    def answer_api_call(self, api_method, path, request_body, query):
+        if api_method == "drive.files.get":
+            return 200, {"modifiedTime": self.modified_time}, {}
+
+        match = self.SPREADSHEET_PATH_PATTERN.match(path)
+        if match is None:
+            return super().answer_api_call(api_method, path, request_body, query)
+        spreadsheet_id = match[1]
+
+        if api_method == "spreadsheets.get":
+            if query.get("includeGridData") == ["true"]:
+                sheets = self.build_grid_data(query.get("ranges", []))
+                if sheets is None:
+                    return (
+                        400,
+                        {"error": {"code": 400, "message": "Unable to parse range"}},
+                        {},
+                    )
+                return 200, {"spreadsheetId": spreadsheet_id, "sheets": sheets}, {}
+
+            return (
+                200,
+                {
+                    "spreadsheetId": spreadsheet_id,
+                    "properties": {"title": "Fake timesheets"},
+                    "sheets": [{"properties": dict(sheet)} for sheet in self.sheets],
+                },
+                {},
+            )
+
+        if api_method == "spreadsheets.batchUpdate":
+            replies = []
+            for one_request in request_body["requests"]:
+                duplicate_sheet = one_request["duplicateSheet"]
+                new_sheet = {
+                    "sheetId": len(self.sheets),
+                    "title": duplicate_sheet["newSheetName"],
+                    "index": duplicate_sheet.get("insertSheetIndex", len(self.sheets)),
+                }
+                self.sheets.append(new_sheet)
+                self.version += 1
+                replies.append({"duplicateSheet": {"properties": dict(new_sheet)}})
+            return 200, {"spreadsheetId": spreadsheet_id, "replies": replies}, {}
+
+        if api_method == "values.batchUpdate":
+            for one_range in request_body["data"]:
+                self.written_ranges[one_range["range"]] = one_range["values"]
+            self.version += 1
+            return (
+                200,
+                {
+                    "spreadsheetId": spreadsheet_id,
+                    "totalUpdatedRanges": len(request_body["data"]),
+                },
+                {},
+            )
+
+        if api_method == "values.update":
+            written_range = urllib.parse.unquote(path.split("/values/", 1)[1])
+            self.written_ranges[written_range] = request_body["values"]
+            self.version += 1
+            return 200, {"spreadsheetId": spreadsheet_id}, {}
+
+        return super().answer_api_call(api_method, path, request_body, query)
+
+
+class RedirectedSession(requests.Session):
+    """HTTP session sending Google API calls to another base URL"""
+
+    GOOGLE_API_URL_PATTERN = re.compile(r"^https://(sheets|www)\.googleapis\.com")
+
+    def __init__(self, base_url):
+        super().__init__()
+        self.base_url = base_url.rstrip("/")
+
+    def request(self, method, url, *args, **kwargs):
+        return super().request(
+            method, self.GOOGLE_API_URL_PATTERN.sub(self.base_url, url), *args, **kwargs
+        )
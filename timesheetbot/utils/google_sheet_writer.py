@@ -1,28 +1,49 @@
 import datetime
+import functools
+import itertools
+import json
 import string
-import gspread
-import gspread_formatting as gf
 import timesheetbot.settings as settings
 import logging
 
-from timesheetbot.models import TimeEntry
-from oauth2client.service_account import ServiceAccountCredentials
+from django.db.models import F, Q
+from django.utils import timezone
+from timesheetbot.models import GoogleApiCache, OffSlotSync, TimeEntry
+from timesheetbot.utils import metrics
+from timesheetbot.utils.sheets_request_scheduler import SheetsRequestScheduler
 
 logger = logging.getLogger(__name__)
 
+GOOGLE_API_SCOPES = [
+    "https://spreadsheets.google.com/feeds",
+    "https://www.googleapis.com/auth/drive",
+]
 
-def is_vacation(sheet, cellref):
-    """Checks if a cell has a non-blank background [= not worked]"""
+DRIVE_FILES_API_URL = "https://www.googleapis.com/drive/v3/files"
 
-    cell_style = gf.get_effective_format(sheet, cellref).backgroundColor
-    if (
-        hasattr(cell_style, "red")
-        and hasattr(cell_style, "green")
-        and hasattr(cell_style, "blue")
-    ):
-        return (cell_style.red < 1) or (cell_style.green < 1) or (cell_style.blue < 1)
+ACCESS_TOKEN_CACHE_KEY = "access_token"
+
+# Credentials & token cipher of each key file, shared by the clients of the process
+credentials_by_key_file = {}
+
+
+def _gspread():
+    """gspread, imported on first use: client libraries are heavy, and only needed by processes actually using the sheet"""
+
+    import gspread
+
+    return gspread
 
-    return True
+
+def get_time_entries_to_write():
+    """Entries never written, or modified since their latest writing"""
+
+    # A slot is a single row, hence all its edits since last run end up in a single cell update
+    return TimeEntry.objects.filter(
+        Q(gsheet_written_at__isnull=True)
+        | Q(modification_time__gt=F("gsheet_written_at")),
+        program__isnull=False,
+    )
 
 
 def format_date_for_tab_name(entrydate: datetime.date):
@@ -60,126 +81,369 @@ def get_column_name_from_number(n):
     return name
 
 
+def build_token_cipher(private_key):
+    """Cipher of stored access tokens, derived from the service account key: only holders of that key can read them"""
+
+    import base64
+    from cryptography.fernet import Fernet
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+    return Fernet(
+        base64.urlsafe_b64encode(
+            HKDF(
+                algorithm=hashes.SHA256(),
+                length=32,
+                salt=None,
+                info=b"timesheetbot access token",
+            ).derive(private_key.encode())
+        )
+    )
+
+
+def load_stored_token(credentials, cipher):
+    """Reuses the access token exchanged by a previous run of the same account, if it can be read"""
+
+    from cryptography.fernet import InvalidToken
+
+    cache = GoogleApiCache.objects.filter(
+        key=ACCESS_TOKEN_CACHE_KEY, version=credentials.service_account_email
+    ).first()
+    if cache is None:
+        return
+
+    try:
+        credentials.token = cipher.decrypt(cache.value["token"].encode()).decode()
+    except (InvalidToken, KeyError):
+        return
+    credentials.expiry = datetime.datetime.fromisoformat(cache.value["expiry"])
+
+
+def store_token(credentials, cipher):
+    """Stores the access token encrypted, for next runs: short-lived processes don't exchange one each"""
+
+    GoogleApiCache.objects.update_or_create(
+        key=ACCESS_TOKEN_CACHE_KEY,
+        defaults={
+            "version": credentials.service_account_email,
+            "value": {
+                "token": cipher.encrypt(credentials.token.encode()).decode(),
+                "expiry": credentials.expiry.isoformat(),
+            },
+        },
+    )
+
+
+def load_credentials():
+    """Service account credentials: their access token is reused, across processes, until it expires"""
+
+    from google.auth.transport.requests import Request
+    from google.oauth2.service_account import Credentials
+
+    key_file = settings.config["GSPREAD_ACCESS_CONF_LOCATION"]
+    if key_file not in credentials_by_key_file:
+        with open(key_file, "r") as hr:
+            key_info = json.load(hr)
+        credentials = Credentials.from_service_account_info(
+            key_info, scopes=GOOGLE_API_SCOPES
+        )
+        cipher = build_token_cipher(key_info["private_key"])
+        load_stored_token(credentials, cipher)
+        credentials_by_key_file[key_file] = (credentials, cipher)
+    credentials, cipher = credentials_by_key_file[key_file]
+
+    # Tokens are exchanged again a few minutes before their expiry
+    if not credentials.valid:
+        credentials.refresh(Request())
+        metrics.gsheet_calls_total.inc("token")
+        store_token(credentials, cipher)
+
+    return credentials
+
+
+def connect_client():
+    """Authorizes a client for the configured spreadsheet; no API call while the cached token is valid"""
+
+    gspread = _gspread()
+
+    # If a sheet is indeed expected to be configured
+    if (
+        settings.config["GSPREAD_SHEET"] is None
+        or settings.config["GSPREAD_ACCESS_CONF_LOCATION"] is None
+        or not settings.config["GSPREAD_SHEET"].startswith("https://docs.google.com")
+    ):
+        raise RuntimeError(
+            "GSPREAD_SHEET and GSPREAD_ACCESS_CONF_LOCATION environment variables are required"
+        )
+
+    if settings.config["GSPREAD_API_BASE_URL"]:
+        # Google API replaced, e.g. by a local fake server: no authentication
+        from timesheetbot.utils.fake_services import RedirectedSession
+
+        return gspread.Client(
+            None,
+            session=RedirectedSession(settings.config["GSPREAD_API_BASE_URL"]),
+        )
+
+    return gspread.authorize(load_credentials())
+
+
+def is_auth_error(error):
+    """Tells whether an error comes from credentials, which only a new client may fix"""
+
+    from google.auth.exceptions import GoogleAuthError
+
+    if isinstance(error, GoogleAuthError):
+        return True
+
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) in (401, 403)
+
+
+class SheetLayout:
+    """Columns of weekly sheets, computed once per run"""
+
+    def __init__(self):
+        """Computes the columns shared by all rows"""
+
+        self.program_first_column_num = get_column_num_from_letter(
+            settings.config["SPREADSHEET_PROGRAM_FIRST_COLUMN"]
+        )
+        self.program_latest_column_num = get_column_num_from_letter(
+            settings.config["SPREADSHEET_PROGRAM_LATEST_COLUMN"]
+        )
+
+        # Rows start with description and work type, then programs
+        self.range_start_column_name = get_column_name_from_number(
+            self.program_first_column_num - 2
+        )
+        self.range_end_column_name = settings.config[
+            "SPREADSHEET_PROGRAM_LATEST_COLUMN"
+        ]
+
+        # Program id => program cells of a row, filled on first use
+        self.program_values = {}
+
+    def get_program_values(self, program):
+        """Returns the program cells of a row: 1 in the program column, blank elsewhere"""
+
+        if program.pk not in self.program_values:
+            program_column_num = get_column_num_from_letter(
+                program.spreadsheet_column_letter
+            )
+            self.program_values[program.pk] = [
+                1 if i == program_column_num else ""
+                for i in range(
+                    self.program_first_column_num, self.program_latest_column_num
+                )
+            ]
+
+        return self.program_values[program.pk]
+
+    def build_range_update(self, time_entry_to_write):
+        """Computes the range and values representing an entry in its sheet"""
+
+        # Current user data start at a configured row
+        current_row = (
+            time_entry_to_write.user.spreadsheet_top_row
+            + 1
+            + time_entry_to_write.date.weekday() * 2
+        )
+
+        if time_entry_to_write.is_afternoon:
+            current_row += 1
+
+        sheet_range = f"{self.range_start_column_name}{current_row}:{self.range_end_column_name}{current_row}"
+
+        values = [
+            [
+                time_entry_to_write.description,
+                time_entry_to_write.work_type.spreadsheet_value
+                if time_entry_to_write.work_type is not None
+                else "",
+            ]
+            + self.get_program_values(time_entry_to_write.program)
+        ]
+
+        return {"range": sheet_range, "values": values}
+
+
 class GoogleSheetWriter:
     """Class to write data in relevant Google spreadsheet"""
 
     def __init__(self):
-        """Connects client to the sheet"""
+        """Connects client to the sheet; the spreadsheet itself is opened when first needed"""
 
+        self.gspread_client = connect_client()
+        # All gspread calls go through the client's request method: they are paced and retried there
+        self.request_scheduler = SheetsRequestScheduler()
+        self.gspread_client.request = functools.partial(
+            self.request_scheduler.request, self.gspread_client.request
+        )
+        self.rows_written = 0
+        self.spreadsheet_id = _gspread().utils.extract_id_from_url(
+            settings.config["GSPREAD_SHEET"]
+        )
         self.client = None
+        self.worksheets_by_title = None
+        self.template_worksheet = None
 
-        # If a sheet is indeed expected to be configured
-        if (
-            settings.config["GSPREAD_SHEET"] is None
-            or settings.config["GSPREAD_ACCESS_CONF_LOCATION"] is None
-            or not settings.config["GSPREAD_SHEET"].startswith(
-                "https://docs.google.com"
-            )
-        ):
-            raise RuntimeError(
-                "GSPREAD_SHEET and GSPREAD_ACCESS_CONF_LOCATION environment variables are required"
-            )
+    def get_spreadsheet_modified_time(self):
+        """Version of the whole spreadsheet: Drive doesn't track sheets separately"""
 
-        # Access the sheets, and store some defaults infos.
-        client = gspread.authorize(
-            ServiceAccountCredentials.from_json_keyfile_name(
-                settings.config["GSPREAD_ACCESS_CONF_LOCATION"],
-                [
-                    "https://spreadsheets.google.com/feeds",
-                    "https://www.googleapis.com/auth/drive",
-                ],
-            )
+        response = self.gspread_client.request(
+            "get",
+            f"{DRIVE_FILES_API_URL}/{self.spreadsheet_id}",
+            params={"fields": "modifiedTime", "supportsAllDrives": True},
         )
-        self.client = client.open_by_url(settings.config["GSPREAD_SHEET"])
+        metrics.gsheet_calls_total.inc("modified_time")
+
+        return response.json()["modifiedTime"]
+
+    def open(self):
+        """Opens the spreadsheet and lists its sheets, once per run"""
 
+        if self.client is not None:
+            return
+
+        # Worksheets are listed once, then the index is maintained as sheets are created
+        self.client = self.gspread_client.open_by_key(self.spreadsheet_id)
+        metrics.gsheet_calls_total.inc("read_metadata")
         all_worksheet = self.client.worksheets()
+        metrics.gsheet_calls_total.inc("read_metadata")
+        self.worksheets_by_title = {w.title: w for w in all_worksheet}
         self.template_worksheet = next(
             w for w in all_worksheet if "template" in w.title.lower()
         )
 
     def write_all_new_data(self):
-        """Main entrypoint: writes all new data to the sheet"""
+        """Main entrypoint: writes all new data to the sheet, then reports what it took, even if it failed"""
+
+        try:
+            self.write_pending_entries()
+        finally:
+            self.log_run_summary()
+
+    def log_run_summary(self):
+        """Logs the requests, waits and rows of the run, i.e. since the previous summary"""
+
+        logger.info(
+            f"Google Sheets run: {self.rows_written} rows written, "
+            + f"{self.request_scheduler.request_count} requests, "
+            + f"{self.request_scheduler.retry_count} retries, "
+            + f"{self.request_scheduler.quota_wait_seconds:.1f}s waiting for quota, "
+            + f"{self.request_scheduler.backoff_wait_seconds:.1f}s backing off"
+        )
+        self.rows_written = 0
+        self.request_scheduler.reset_summary()
 
-        # Provided a sheet has been configured...
-        if self.client is None:
-            return
+    def write_pending_entries(self):
+        """Writes entries by date, sheet after sheet"""
 
-        # Arrays for which we may have to recompute the number of worked days
-        current_sheet_name = None
-        current_sheet = None
+        # Entries modified from now on will have to be written again by next run
+        self.run_start_time = timezone.now()
 
         # Loop over all the new data
-        time_entries_to_write = TimeEntry.objects.filter(
-            has_been_written_in_gsheet=False,
-            program__isnull=False,
-        ).order_by("date")
-
-        for time_entry_to_write in time_entries_to_write:
-            # Identify concerned sheet, select or create that sheet
-            sheet_name = get_sheet_name_from_date(time_entry_to_write.date)
-            if sheet_name != current_sheet_name:
-                current_sheet_name = sheet_name
-                try:
-                    current_sheet = self.client.worksheet(current_sheet_name)
-                except gspread.exceptions.WorksheetNotFound:
-                    current_sheet = self.create_new_sheet_from_model(current_sheet_name)
-
-            # Current user data start at a configured row, let's fill data
-            # Also: let's keep in mind that we modified a sheet for a given user
-            user_start_row = time_entry_to_write.user.spreadsheet_top_row
-            current_row = user_start_row + 1 + time_entry_to_write.date.weekday() * 2
-
-            if time_entry_to_write.is_afternoon:
-                current_row += 1
-
-            program_first_column_num = get_column_num_from_letter(
-                settings.config["SPREADSHEET_PROGRAM_FIRST_COLUMN"]
-            )
-            program_latest_column_num = get_column_num_from_letter(
-                settings.config["SPREADSHEET_PROGRAM_LATEST_COLUMN"]
-            )
-            program_column_num = get_column_num_from_letter(
-                time_entry_to_write.program.spreadsheet_column_letter
-            )
+        time_entries_to_write = get_time_entries_to_write().order_by("date")
 
-            sheet_range_start_column_name = get_column_name_from_number(
-                program_first_column_num - 2
-            )
+        # Nothing to write: the spreadsheet is not even opened
+        dates_to_write = list(
+            time_entries_to_write.values_list("date", flat=True).distinct()
+        )
+        if not len(dates_to_write):
+            return
 
-            sheet_range = f'{sheet_range_start_column_name}{current_row}:{settings.config["SPREADSHEET_PROGRAM_LATEST_COLUMN"]}{current_row}'
+        # Version before the bot's own writes, which change no background color
+        modified_time_before_writes = self.get_spreadsheet_modified_time()
+        self.open()
+
+        # Creates all the missing sheets at once, in chronological order
+        missing_sheet_names = []
+        for date in dates_to_write:
+            sheet_name = get_sheet_name_from_date(date)
+            if (
+                sheet_name not in self.worksheets_by_title
+                and sheet_name not in missing_sheet_names
+            ):
+                missing_sheet_names.append(sheet_name)
+        if len(missing_sheet_names):
+            self.create_new_sheets_from_model(missing_sheet_names)
+
+        # Entries are streamed with their relations, sorted by date: entries of a same sheet follow each other
+        self.layout = SheetLayout()
+        for sheet_name, sheet_time_entries in itertools.groupby(
+            time_entries_to_write.select_related(
+                "user", "program", "work_type"
+            ).iterator(chunk_size=settings.config["SPREADSHEET_QUERY_CHUNK_SIZE"]),
+            key=lambda time_entry: get_sheet_name_from_date(time_entry.date),
+        ):
+            current_sheet = self.worksheets_by_title[sheet_name]
+
+            # Write its entries by batches, a single request each
+            time_entries_batch = []
+            for time_entry_to_write in sheet_time_entries:
+                time_entries_batch.append(time_entry_to_write)
+                if (
+                    len(time_entries_batch)
+                    >= settings.config["SPREADSHEET_BATCH_MAX_RANGES"]
+                ):
+                    self.write_batch(current_sheet, time_entries_batch)
+                    time_entries_batch = []
+
+            if len(time_entries_batch):
+                self.write_batch(current_sheet, time_entries_batch)
+
+        # Off-slots read at the version written over are still current: they are not read again for these writes
+        # Colors changed by hand while writing are missed until the next outside change, or the sync expiry
+        OffSlotSync.objects.filter(
+            spreadsheet_modified_time=modified_time_before_writes
+        ).update(spreadsheet_modified_time=self.get_spreadsheet_modified_time())
+
+    def write_batch(self, sheet, time_entries):
+        """Writes entries of a same sheet in a single request, then flags them"""
+
+        sheet.batch_update(
+            [self.layout.build_range_update(time_entry) for time_entry in time_entries]
+        )
+        metrics.gsheet_calls_total.inc("write_rows")
+        metrics.gsheet_rows_written_total.inc(amount=len(time_entries))
+        self.rows_written += len(time_entries)
+
+        # For performance/logic issues, we memorize that data have already been written
+        # Flagged batch by batch: an interrupted run is resumed after its last written batch
+        TimeEntry.objects.filter(
+            pk__in=[time_entry.pk for time_entry in time_entries]
+        ).update(gsheet_written_at=self.run_start_time)
+        logger.info(
+            f"{len(time_entries)} timesheet entries have been successfully added to GSheet ({sheet.title})"
+        )
 
-            values = [
-                [
-                    time_entry_to_write.description,
-                    time_entry_to_write.work_type.spreadsheet_value
-                    if time_entry_to_write.work_type is not None
-                    else "",
+    def create_new_sheets_from_model(self, new_sheet_names):
+        """Duplicates the template at the last positions once per name, in a single request"""
+
+        first_sheet_index = len(self.worksheets_by_title)
+        response = self.client.batch_update(
+            {
+                "requests": [
+                    {
+                        "duplicateSheet": {
+                            "sourceSheetId": self.template_worksheet.id,
+                            "insertSheetIndex": first_sheet_index + sheet_num,
+                            "newSheetName": new_sheet_name,
+                        }
+                    }
+                    for sheet_num, new_sheet_name in enumerate(new_sheet_names)
                 ]
-            ]
-
-            for i in range(program_first_column_num, program_latest_column_num):
-                if i == program_column_num:
-                    values[0].append(1)
-                else:
-                    values[0].append("")
-
-            current_sheet.update(
-                sheet_range,
-                values,
-            )
+            }
+        )
+        metrics.gsheet_calls_total.inc("create_sheets")
 
-            # For performance/logic issues, we memorize that data have already been written
-            time_entry_to_write.has_been_written_in_gsheet = True
-            time_entry_to_write.save()
-            logger.info(
-                f"Timesheet entry {time_entry_to_write.id} has been successfully added to GSheet"
+        new_sheets = []
+        for reply in response["replies"]:
+            new_sheet = _gspread().Worksheet(
+                self.client, reply["duplicateSheet"]["properties"]
             )
+            self.worksheets_by_title[new_sheet.title] = new_sheet
+            new_sheets.append(new_sheet)
 
-    def create_new_sheet_from_model(self, new_sheet_name):
-        """When a needed sheet does not exist: duplicates a template at the last position to create that sheet"""
-
-        return self.client.duplicate_sheet(
-            self.template_worksheet.id,
-            new_sheet_name=new_sheet_name,
-            insert_sheet_index=len(self.client.worksheets()),
-        )
+        return new_sheets
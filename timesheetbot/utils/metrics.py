@@ -0,0 +1,408 @@
+import bisect
+import http.server
+import json
+import logging
+import os
+import threading
+import time
+import timesheetbot.settings as settings
+
+logger = logging.getLogger(__name__)
+
+# Added to Slack payloads by the webhook, hence shared by all handling modes
+RECEPTION_TIME_KEY = "timesheetbot_received_at"
+
+# Seconds; Slack gives up on webhooks & trigger ids after 3 seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 10, 30, 60)
+
+
+def format_labels(label_names, label_values, extra=""):
+    """Prometheus text representation of labels"""
+
+    labels = [
+        f'{name}="{str(value)}"' for name, value in zip(label_names, label_values)
+    ]
+    if extra:
+        labels.append(extra)
+
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Counter:
+    """Monotonic count, per label values"""
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        return self.values.get(label_values, 0)
+
+    def copy_empty(self):
+        return Counter(self.name, self.documentation, self.label_names)
+
+    def snapshot(self):
+        """Values as JSON-serializable pairs, for another process to merge"""
+
+        with self.lock:
+            return [
+                [list(label_values), value]
+                for label_values, value in self.values.items()
+            ]
+
+    def merge(self, snapshot):
+        """Adds the values of another process"""
+
+        for label_values, value in snapshot:
+            self.inc(*label_values, amount=value)
+
+    def render(self):
+        """Lines of the Prometheus text format"""
+
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append(
+                    f"{self.name}{format_labels(self.label_names, label_values)} {value}"
+                )
+
+        return lines
+
+    def summarize(self):
+        """Short human readable representation, for logs"""
+
+        with self.lock:
+            return {
+                ",".join(map(str, label_values)) or "all": value
+                for label_values, value in sorted(self.values.items())
+            }
+
+
+class Histogram:
+    """Distribution of observed values, per label values"""
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        # Label values => (counts per bucket, sum, count)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            if label_values not in self.values:
+                self.values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            bucket_counts, _, _ = self.values[label_values]
+            # Buckets are cumulated when rendered
+            bucket_num = bisect.bisect_left(self.buckets, value)
+            if bucket_num < len(self.buckets):
+                bucket_counts[bucket_num] += 1
+            self.values[label_values][1] += value
+            self.values[label_values][2] += 1
+
+    def time(self, *label_values):
+        """Context manager observing the duration of its block"""
+
+        return HistogramTimer(self, label_values)
+
+    def copy_empty(self):
+        return Histogram(self.name, self.documentation, self.label_names, self.buckets)
+
+    def snapshot(self):
+        """Values as JSON-serializable pairs, for another process to merge"""
+
+        with self.lock:
+            return [
+                [list(label_values), [list(bucket_counts), total, count]]
+                for label_values, (bucket_counts, total, count) in self.values.items()
+            ]
+
+    def merge(self, snapshot):
+        """Adds the observations of another process"""
+
+        with self.lock:
+            for label_values, (bucket_counts, total, count) in snapshot:
+                values = self.values.setdefault(
+                    tuple(label_values), [[0] * len(self.buckets), 0.0, 0]
+                )
+                values[0] = [a + b for a, b in zip(values[0], bucket_counts)]
+                values[1] += total
+                values[2] += count
+
+    def render(self):
+        """Lines of the Prometheus text format"""
+
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self.lock:
+            for label_values, (bucket_counts, total, count) in sorted(
+                self.values.items()
+            ):
+                cumulated_count = 0
+                for bucket, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulated_count += bucket_count
+                    lines.append(
+                        f"{self.name}_bucket"
+                        + format_labels(
+                            self.label_names, label_values, f'le="{bucket}"'
+                        )
+                        + f" {cumulated_count}"
+                    )
+                lines.append(
+                    f"{self.name}_bucket"
+                    + format_labels(self.label_names, label_values, 'le="+Inf"')
+                    + f" {count}"
+                )
+                labels = format_labels(self.label_names, label_values)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+
+        return lines
+
+    def summarize(self):
+        """Short human readable representation, for logs"""
+
+        with self.lock:
+            return {
+                ",".join(map(str, label_values))
+                or "all": {"count": count, "mean": total / count}
+                for label_values, (_, total, count) in sorted(self.values.items())
+            }
+
+
+class HistogramTimer:
+    """Observes the time spent in a `with` block"""
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+
+# Metrics are per process: gunicorn workers save snapshots, summed by the master when scraped
+webhook_seconds = Histogram(
+    "timesheetbot_webhook_seconds",
+    "Time to answer a Slack webhook",
+)
+signature_failures_total = Counter(
+    "timesheetbot_signature_failures_total",
+    "Slack webhooks rejected by signature verification",
+    ("reason",),
+)
+slack_request_wait_seconds = Histogram(
+    "timesheetbot_slack_request_wait_seconds",
+    "Time between the reception of a Slack request and the start of its handling",
+    ("handling_mode",),
+)
+slack_worker_queue_full_total = Counter(
+    "timesheetbot_slack_worker_queue_full_total",
+    "Slack requests handled in a subprocess because the worker queue stayed full",
+)
+slack_trigger_age_seconds = Histogram(
+    "timesheetbot_slack_trigger_age_seconds",
+    "Age of the trigger id when opening a modal; Slack rejects it after 3 seconds",
+)
+find_missing_data_seconds = Histogram(
+    "timesheetbot_find_missing_data_seconds",
+    "Time to find the missing time entries of a user",
+)
+slack_api_seconds = Histogram(
+    "timesheetbot_slack_api_seconds",
+    "Slack API call latency, retries included",
+    ("method",),
+)
+slack_api_errors_total = Counter(
+    "timesheetbot_slack_api_errors_total",
+    "Failed Slack API calls",
+    ("method", "error"),
+)
+gsheet_calls_total = Counter(
+    "timesheetbot_gsheet_calls_total",
+    "Google Sheets API calls",
+    ("call",),
+)
+gsheet_retries_total = Counter(
+    "timesheetbot_gsheet_retries_total",
+    "Google API calls retried after a rate limit or a server error",
+    ("reason",),
+)
+gsheet_wait_seconds_total = Counter(
+    "timesheetbot_gsheet_wait_seconds_total",
+    "Time spent waiting before Google API calls: for quota, or backing off after errors",
+    ("reason",),
+)
+gsheet_rows_written_total = Counter(
+    "timesheetbot_gsheet_rows_written_total",
+    "Time entries written to Google Sheets",
+)
+hourly_tasks_seconds = Histogram(
+    "timesheetbot_hourly_tasks_seconds",
+    "Duration of the hourly tasks",
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+
+ALL_METRICS = [
+    webhook_seconds,
+    signature_failures_total,
+    slack_request_wait_seconds,
+    slack_worker_queue_full_total,
+    slack_trigger_age_seconds,
+    find_missing_data_seconds,
+    slack_api_seconds,
+    slack_api_errors_total,
+    gsheet_calls_total,
+    gsheet_retries_total,
+    gsheet_wait_seconds_total,
+    gsheet_rows_written_total,
+    hourly_tasks_seconds,
+]
+
+
+def stamp_reception(request_data):
+    """Remembers when a Slack request was received, for later waiting time measures"""
+
+    request_data[RECEPTION_TIME_KEY] = time.time()
+
+
+def observe_request_wait(request_data, handling_mode):
+    """Measures how long a Slack request waited before being handled"""
+
+    if RECEPTION_TIME_KEY in request_data:
+        slack_request_wait_seconds.observe(
+            time.time() - request_data[RECEPTION_TIME_KEY], handling_mode
+        )
+
+
+def render_metrics():
+    """All metrics, in Prometheus text format"""
+
+    return "\n".join(line for metric in ALL_METRICS for line in metric.render()) + "\n"
+
+
+def write_snapshot(directory):
+    """Saves the metrics of the process in a directory, replacing its previous snapshot at once"""
+
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    with open(path + ".tmp", "w") as hw:
+        json.dump({metric.name: metric.snapshot() for metric in ALL_METRICS}, hw)
+    os.replace(path + ".tmp", path)
+
+
+def start_snapshot_writer(directory, interval):
+    """Saves the metrics of the process every `interval` seconds, in a background thread"""
+
+    def write_snapshots():
+        while True:
+            time.sleep(interval)
+            try:
+                write_snapshot(directory)
+            except OSError:
+                logger.exception("Error while saving metrics")
+
+    threading.Thread(
+        target=write_snapshots, name="metrics-snapshots", daemon=True
+    ).start()
+
+
+def render_snapshots(directory):
+    """Metrics saved by all processes, exited ones included (counters never go back), summed as if a single process"""
+
+    merged_metrics = [metric.copy_empty() for metric in ALL_METRICS]
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, file_name), "r") as hr:
+                snapshot = json.load(hr)
+        except (OSError, ValueError):
+            logger.exception(f"Unreadable metrics snapshot {file_name}")
+            continue
+        for metric in merged_metrics:
+            metric.merge(snapshot.get(metric.name, []))
+
+    return (
+        "\n".join(line for metric in merged_metrics for line in metric.render()) + "\n"
+    )
+
+
+def summarize_metrics():
+    """All observed metrics, as a dict fit for a log line"""
+
+    return {metric.name: metric.summarize() for metric in ALL_METRICS if metric.values}
+
+
+def report_metrics(job_name):
+    """Logs a summary of the run, and pushes the metrics to a Prometheus pushgateway if configured"""
+
+    logger.info(f"{job_name} metrics: {summarize_metrics()}")
+
+    if settings.config["METRICS_PUSHGATEWAY_URL"]:
+        import requests
+
+        try:
+            requests.put(
+                settings.config["METRICS_PUSHGATEWAY_URL"].rstrip("/")
+                + f"/metrics/job/{job_name}",
+                data=render_metrics().encode("utf-8"),
+                timeout=10,
+            ).raise_for_status()
+        except requests.RequestException:
+            logger.exception("Error while pushing metrics")
+
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Exposes metrics to Prometheus, as rendered by the server"""
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+
+        body = self.server.render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, render=render_metrics):
+    """Serves metrics on an internal port, apart from the public web server, in a background thread"""
+
+    try:
+        server = http.server.ThreadingHTTPServer(
+            ("0.0.0.0", port), MetricsRequestHandler
+        )
+    except OSError:
+        logger.exception(f"Metrics can't be served on port {port}")
+        return None
+    server.render_metrics = render
+
+    threading.Thread(
+        target=server.serve_forever, name="metrics-server", daemon=True
+    ).start()
+
+    return server
@@ -0,0 +1,214 @@
+import datetime
+import logging
+import timesheetbot.settings as settings
+
+from django.db import transaction
+from django.utils import timezone
+from timesheetbot.models import OffSlot, OffSlotSync, User
+from timesheetbot.utils import metrics
+from timesheetbot.utils.google_sheet_writer import SheetLayout, get_sheet_name_from_date
+from timesheetbot.utils.slot_summary import forget_slot_summaries
+from timesheetbot.utils.time_slot import (
+    get_time_slot,
+    get_time_slot_date,
+    is_morning_time_slot,
+)
+
+logger = logging.getLogger(__name__)
+
+# Only background colors are downloaded, not values nor other formats
+GRID_DATA_FIELDS = "sheets(properties(title),data(startRow,rowData(values(effectiveFormat(backgroundColor)))))"
+
+# Morning & afternoon rows of the 5 week days
+ROWS_PER_USER = 10
+
+
+def is_off_background_color(background_color):
+    """Tells whether a cell background is colored [= not worked]; missing components are 0"""
+
+    return any(
+        background_color.get(component, 0) < 1 for component in ("red", "green", "blue")
+    )
+
+
+class OffSlotReader:
+    """Reads half-days colored as not worked in weekly sheets, and stores them as off-slots"""
+
+    def __init__(self, sheet_writer):
+        """Works through a sheet writer, which opens the spreadsheet only when a sheet has to be read"""
+
+        self.sheet_writer = sheet_writer
+
+    def find_sheets_to_sync(self, first_date, modified_time):
+        """Existing weekly sheets from first_date to today, not read since the spreadsheet changed, or for too long"""
+
+        # The version is carried over the bot's own writes, without reading again: readings still expire
+        synced_titles = set(
+            OffSlotSync.objects.filter(
+                spreadsheet_modified_time=modified_time,
+                sync_time__gte=timezone.now()
+                - datetime.timedelta(
+                    hours=settings.config["OFF_SLOT_SYNC_MAX_AGE_HOURS"]
+                ),
+            ).values_list("sheet_title", flat=True)
+        )
+
+        sheets_to_sync = {}
+        monday = first_date - datetime.timedelta(days=first_date.weekday())
+        while monday <= datetime.date.today():
+            sheet_title = get_sheet_name_from_date(monday)
+            if sheet_title not in synced_titles:
+                sheets_to_sync[sheet_title] = monday
+            monday += datetime.timedelta(days=7)
+        if not len(sheets_to_sync):
+            return sheets_to_sync
+
+        self.sheet_writer.open()
+        return {
+            sheet_title: monday
+            for sheet_title, monday in sheets_to_sync.items()
+            if sheet_title in self.sheet_writer.worksheets_by_title
+        }
+
+    def read_off_time_slots(self, sheets_to_sync, users):
+        """Off time slots of each user, from the cells of all given sheets in a single request"""
+
+        # Row => (user, weekday, is_morning), over the block of rows of each user
+        row_owners = {}
+        for user in users:
+            for row_offset in range(ROWS_PER_USER):
+                row_owners[user.spreadsheet_top_row + 1 + row_offset] = (
+                    user.pk,
+                    row_offset // 2,
+                    row_offset % 2 == 0,
+                )
+        first_row, last_row = min(row_owners), max(row_owners)
+
+        # The first column of entries rows is checked: the one of descriptions
+        column_name = SheetLayout().range_start_column_name
+        response = self.sheet_writer.client.fetch_sheet_metadata(
+            params={
+                "includeGridData": "true",
+                "ranges": [
+                    f"'{sheet_title}'!{column_name}{first_row}:{column_name}{last_row}"
+                    for sheet_title in sheets_to_sync
+                ],
+                "fields": GRID_DATA_FIELDS,
+            }
+        )
+        metrics.gsheet_calls_total.inc("read_formats")
+
+        off_time_slots = {}
+        for sheet in response.get("sheets", []):
+            monday = sheets_to_sync[sheet["properties"]["title"]]
+            for grid_data in sheet.get("data", []):
+                # Rows are 0-indexed in grid data; trailing empty cells are omitted
+                row = grid_data.get("startRow", 0) + 1
+                for row_data in grid_data.get("rowData", []):
+                    cells = row_data.get("values", [])
+                    if (
+                        row in row_owners
+                        and len(cells)
+                        and is_off_background_color(
+                            cells[0]
+                            .get("effectiveFormat", {})
+                            .get("backgroundColor", {"red": 1, "green": 1, "blue": 1})
+                        )
+                    ):
+                        user_id, weekday, is_morning = row_owners[row]
+                        off_time_slots.setdefault(user_id, set()).add(
+                            get_time_slot(
+                                monday + datetime.timedelta(days=weekday), is_morning
+                            )
+                        )
+                    row += 1
+
+        return off_time_slots
+
+    def store_off_time_slots(self, sheets_to_sync, off_time_slots, modified_time):
+        """Replaces the off-slots read from the synced weeks, touching only the ones that changed; manual ones are kept"""
+
+        synced_dates = {
+            monday + datetime.timedelta(days=weekday)
+            for monday in sheets_to_sync.values()
+            for weekday in range(5)
+        }
+        new_keys = {
+            (user_id, time_slot)
+            for user_id, time_slots in off_time_slots.items()
+            for time_slot in time_slots
+        }
+
+        with transaction.atomic():
+            existing_pks = {}
+            manual_keys = set()
+            for off_slot in OffSlot.objects.filter(date__in=synced_dates).values(
+                "pk", "user_id", "date", "is_morning", "source"
+            ):
+                key = (
+                    off_slot["user_id"],
+                    get_time_slot(off_slot["date"], off_slot["is_morning"]),
+                )
+                if off_slot["source"] == OffSlot.SOURCE_SHEET:
+                    existing_pks[key] = off_slot["pk"]
+                else:
+                    manual_keys.add(key)
+
+            # Half-days already off by hand stay so, whatever the sheet says
+            removed_keys = [key for key in existing_pks if key not in new_keys]
+            added_keys = [
+                key
+                for key in new_keys
+                if key not in existing_pks and key not in manual_keys
+            ]
+            OffSlot.objects.filter(
+                pk__in=[existing_pks[key] for key in removed_keys]
+            ).delete()
+            OffSlot.objects.bulk_create(
+                [
+                    OffSlot(
+                        user_id=user_id,
+                        date=get_time_slot_date(time_slot),
+                        is_morning=is_morning_time_slot(time_slot),
+                        source=OffSlot.SOURCE_SHEET,
+                    )
+                    for user_id, time_slot in added_keys
+                ]
+            )
+            # Missing slots of those users are computed again on next use
+            forget_slot_summaries({user_id for user_id, _ in removed_keys + added_keys})
+            OffSlotSync.objects.bulk_create(
+                [
+                    OffSlotSync(
+                        sheet_title=sheet_title,
+                        spreadsheet_modified_time=modified_time,
+                    )
+                    for sheet_title in sheets_to_sync
+                ],
+                update_conflicts=True,
+                unique_fields=["sheet_title"],
+                update_fields=["spreadsheet_modified_time", "sync_time"],
+            )
+
+    def refresh(self):
+        """Main entrypoint: reads the sheets changed since their last reading; returns how many were read"""
+
+        users = list(User.objects.all())
+        if not len(users):
+            return 0
+
+        # Older sheets are not analyzed anymore
+        first_date = min(user.look_for_data_starting_at for user in users)
+        modified_time = self.sheet_writer.get_spreadsheet_modified_time()
+        sheets_to_sync = self.find_sheets_to_sync(first_date, modified_time)
+        if not len(sheets_to_sync):
+            return 0
+
+        off_time_slots = self.read_off_time_slots(sheets_to_sync, users)
+        self.store_off_time_slots(sheets_to_sync, off_time_slots, modified_time)
+        logger.info(
+            f"Off-slots of {len(sheets_to_sync)} sheets have been read: "
+            + f"{sum(map(len, off_time_slots.values()))} half-days off"
+        )
+
+        return len(sheets_to_sync)
@@ -0,0 +1,52 @@
+import copy
+import json
+import os
+import threading
+import time
+import timesheetbot.settings as settings
+
+# Static payloads are parsed once per process, then copied for each request
+_payload_templates = {}
+
+# Options lists built from the database, with the time they were built at
+_options_cache = {}
+_options_cache_lock = threading.Lock()
+
+
+def get_payload_template(payload_name):
+    """Returns a private copy of a static json payload, given its file name"""
+
+    if payload_name not in _payload_templates:
+        with open(
+            os.path.join(settings.STATIC_ROOT, "json_payloads", payload_name), "r"
+        ) as hr:
+            _payload_templates[payload_name] = json.load(hr)
+
+    return copy.deepcopy(_payload_templates[payload_name])
+
+
+def get_cached_options(options_name, build_options):
+    """Returns options built by `build_options`, rebuilt only after an invalidation or expiry
+
+    Returned lists are shared: they must not be modified.
+    """
+
+    with _options_cache_lock:
+        cached = _options_cache.get(options_name)
+        # Expiry covers changes made from other processes, which signals don't reach
+        if (
+            cached is None
+            or time.monotonic() - cached[0]
+            > settings.config["SLACK_OPTIONS_CACHE_TTL_SECONDS"]
+        ):
+            cached = (time.monotonic(), build_options())
+            _options_cache[options_name] = cached
+
+    return cached[1]
+
+
+def invalidate_options_cache(**kwargs):
+    """Signal receiver: forgets all options lists"""
+
+    with _options_cache_lock:
+        _options_cache.clear()
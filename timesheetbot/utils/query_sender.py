@@ -1,14 +1,66 @@
-import datetime
 import json
-import os
-import requests
+import threading
+import time
 import timesheetbot.settings as settings
 import logging
 
 from timesheetbot.models import TimeEntry, WorkType, Program
+from timesheetbot.utils import metrics
+from timesheetbot.utils.payload_cache import get_cached_options, get_payload_template
+from timesheetbot.utils.time_slot import get_time_slot_date, is_morning_time_slot
 
 logger = logging.getLogger(__name__)
 
+# Modal filling several time slots at once; Slack allows at most 10 checkboxes
+WEEK_MODAL_CALLBACK_ID = "week-modal"
+WEEK_MODAL_MAX_TIME_SLOTS = 10
+
+# All Slack API calls of a process share pooled keep-alive connections
+_slack_session = None
+_slack_session_lock = threading.Lock()
+
+
+def _requests():
+    """requests, imported on first use: sparing processes that never call Slack"""
+
+    import requests
+
+    return requests
+
+
+def get_slack_session():
+    """Returns the process-wide HTTP session used towards Slack API, created on first use"""
+
+    global _slack_session
+
+    with _slack_session_lock:
+        if _slack_session is None:
+            requests = _requests()
+            from urllib3.util.retry import Retry
+
+            # Posts are not idempotent (a DM would be sent twice): only retried when Slack can't have processed them,
+            # i.e. connection failures and 503. A 502/504 from a proxy, or a read timeout, may come after processing.
+            retries = Retry(
+                total=settings.config["SLACK_HTTP_RETRIES"],
+                read=0,
+                other=0,
+                status_forcelist=(503,),
+                allowed_methods=None,
+                backoff_factor=settings.config["SLACK_HTTP_BACKOFF_FACTOR"],
+                raise_on_status=False,
+            )
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=settings.config["SLACK_HTTP_POOL_SIZE"],
+                max_retries=retries,
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _slack_session = session
+
+    return _slack_session
+
 
 def template_insert(entrytext, dict_replacement):
     """Simple utility to replace values in text according to replacements dict"""
@@ -23,8 +75,8 @@ def template_insert(entrytext, dict_replacement):
     return out_text
 
 
-def format_date(date_string):
-    """Given a date in a "YYY-MM-DD_[0|1]" format, return a human readable date"""
+def format_date(time_slot):
+    """Given a time slot, return a human readable date"""
 
     days_names = [
         "Monday",
@@ -36,13 +88,12 @@ def format_date(date_string):
         "Sunday",
     ]
 
-    date_body = date_string.split("_")[0]
-    date_object = datetime.date(*[int(part) for part in date_body.split("-")])
+    date_object = get_time_slot_date(time_slot)
 
     day_name = days_names[date_object.weekday()]
-    day_period = "morning" if date_string.endswith("_0") else "afternoon"
+    day_period = "morning" if is_morning_time_slot(time_slot) else "afternoon"
 
-    return f"{day_name} {day_period} ({date_body})"
+    return f"{day_name} {day_period} ({date_object})"
 
 
 def build_program_options():
@@ -93,27 +144,99 @@ class QuerySender:
     def __init__(self):
         """Initialization: only the header is concerned"""
 
-        self.default_header = {"Content-type": "application/json; charset=utf-8"}
+        # The headers must also include an authorization token for the chats/views API
+        self.default_header = {
+            "Content-type": "application/json; charset=utf-8",
+            "Authorization": "Bearer " + settings.config["SLACK_BEARER_TOKEN"],
+        }
 
-    def prepare_and_send_modal(self, trigger_id, user_id, date_repr):
+    def post(self, url, payload):
+        """Posts a json payload to Slack API through the shared session, measuring it"""
+
+        api_method = url.rsplit("/", 1)[-1]
+        with metrics.slack_api_seconds.time(api_method):
+            try:
+                response = self.post_with_retries(url, payload)
+            except _requests().RequestException as e:
+                metrics.slack_api_errors_total.inc(api_method, type(e).__name__)
+                raise
+
+        # Slack answers most errors with a 200 status, telling the error in the body
+        if response.status_code != 200:
+            metrics.slack_api_errors_total.inc(
+                api_method, f"http_{response.status_code}"
+            )
+        else:
+            try:
+                slack_error = response.json().get("error")
+            except ValueError:
+                slack_error = "invalid_json"
+            if slack_error is not None:
+                metrics.slack_api_errors_total.inc(api_method, slack_error)
+
+        return response
+
+    def post_with_retries(self, url, payload):
+        """Posts a json payload, waiting as long as Slack asks when rate limited"""
+
+        data = json.dumps(payload)
+        attempt_num = 0
+        while True:
+            response = get_slack_session().post(
+                url,
+                data=data,
+                headers=self.default_header,
+                timeout=settings.config["SLACK_HTTP_TIMEOUT_SECONDS"],
+            )
+
+            # Rate limited: Slack tells how long to wait before trying again
+            if (
+                response.status_code != 429
+                or attempt_num >= settings.config["SLACK_RATE_LIMIT_MAX_RETRIES"]
+            ):
+                return response
+            attempt_num += 1
+            retry_after = int(response.headers.get("Retry-After", 1))
+            logger.warning(f"Rate limited by Slack API, retrying in {retry_after}s")
+            time.sleep(retry_after)
+
+    def prepare_and_send_modal(self, trigger_id, user_id, time_slot):
         """Preapare and builds the modal menu asking for informations to user"""
 
+        self.open_view(trigger_id, self.prepare_modal(user_id, time_slot))
+
+    def prepare_and_send_week_modal(self, trigger_id, time_slots):
+        """Prepares and opens the modal filling several time slots at once"""
+
+        self.open_view(trigger_id, self.prepare_week_modal(time_slots))
+
+    def open_view(self, trigger_id, view_data):
+        """Opens a modal view in answer to a user action"""
+
+        res = self.post(
+            settings.config["SLACK_VIEW_API_URL"],
+            {"trigger_id": trigger_id, "view": view_data},
+        ).json()
+
+        if res["ok"] is not True:
+            logger.error(res)
+            raise Exception("Error while sending modal.")
+
+    def prepare_modal(self, user_id, time_slot):
+        """Builds the modal view asking for informations about a time slot"""
+
         # Loads the template
-        with open(
-            os.path.join(settings.STATIC_ROOT, "json_payloads", "modal.json"), "r"
-        ) as hr:
-            view_data = json.load(hr)
+        view_data = get_payload_template("modal.json")
 
         # Retrieves the data for user/timeslot if it exists
         maybe_timesheet_entry = TimeEntry.objects.filter(
             user=user_id,
-            date=datetime.date(
-                *[int(part) for part in date_repr.split("_")[0].split("-")]
-            ),
-            is_morning=(date_repr.endswith("_0")),
+            date=get_time_slot_date(time_slot),
+            is_morning=is_morning_time_slot(time_slot),
         ).first()
 
-        # Fill the template
+        # Fill the template; the time slot is kept for the submission
+        view_data["private_metadata"] = str(time_slot)
         view_data["blocks"][2]["element"]["initial_value"] = (
             maybe_timesheet_entry.description
             if maybe_timesheet_entry is not None
@@ -121,7 +244,7 @@ class QuerySender:
         )
         view_data["blocks"][2]["label"]["text"] = template_insert(
             view_data["blocks"][2]["label"]["text"],
-            {"time_period": format_date(date_repr)},
+            {"time_period": format_date(time_slot)},
         )
         if maybe_timesheet_entry is not None:
             maybe_work_type = maybe_timesheet_entry.work_type
@@ -133,52 +256,52 @@ class QuerySender:
                     },
                     "value": maybe_work_type.slack_value,
                 }
-        view_data["blocks"][4]["element"]["options"] = build_work_type_options()
-        view_data["blocks"][6]["accessory"]["options"] = build_program_options()
-
-        # The headers must also include an authorization token for the views API
-        final_header = self.default_header
-        final_header["Authorization"] = (
-            "Bearer " + settings.config["SLACK_BEARER_TOKEN"]
+        view_data["blocks"][4]["element"]["options"] = get_cached_options(
+            "work_types", build_work_type_options
+        )
+        view_data["blocks"][6]["accessory"]["options"] = get_cached_options(
+            "programs", build_program_options
         )
 
-        # Finally post the request
-        res = requests.post(
-            settings.config["SLACK_VIEW_API_URL"],
-            data=json.dumps({"trigger_id": trigger_id, "view": view_data}),
-            headers=final_header,
-        ).json()
+        return view_data
 
-        if res["ok"] is not True:
-            logger.error(res)
-            raise Exception("Error while sending modal.")
+    def prepare_week_modal(self, time_slots):
+        """Builds the modal view asking for informations shared by several time slots, all checked by default"""
 
-    def send_simple_message(self, message, slack_user_id):
-        """Posting a simple/non-formatted message to a given channel"""
+        # Loads the template
+        view_data = get_payload_template("week_modal.json")
 
-        # The headers must also include an authorization token for the chats API
-        final_header = self.default_header
-        final_header["Authorization"] = (
-            "Bearer " + settings.config["SLACK_BEARER_TOKEN"]
+        # Fill the template
+        time_slot_options = [
+            {
+                "text": {"type": "plain_text", "text": format_date(time_slot)},
+                "value": str(time_slot),
+            }
+            for time_slot in time_slots
+        ]
+        view_data["blocks"][2]["element"]["options"] = time_slot_options
+        view_data["blocks"][2]["element"]["initial_options"] = time_slot_options
+        view_data["blocks"][6]["element"]["options"] = get_cached_options(
+            "work_types", build_work_type_options
+        )
+        view_data["blocks"][8]["accessory"]["options"] = get_cached_options(
+            "programs", build_program_options
         )
 
+        return view_data
+
+    def send_simple_message(self, message, slack_user_id):
+        """Posting a simple/non-formatted message to a given channel"""
+
         message_formatted = {"channel": slack_user_id, "text": message}
 
-        requests.post(
-            settings.config["SLACK_CHAT_API_URL"],
-            data=json.dumps(message_formatted),
-            headers=final_header,
-        )
+        self.post(settings.config["SLACK_CHAT_API_URL"], message_formatted)
 
     def prepare_and_send_notification(self, user_object, count_missing_entries):
-        """Posting a notification asking to fill missing data to user private channel"""
+        """Posting a notification asking to fill missing data to user private channel; returns whether it succeeded"""
 
         # Loads the template
-        with open(
-            os.path.join(settings.STATIC_ROOT, "json_payloads", "notification.json"),
-            "r",
-        ) as hr:
-            notification = json.load(hr)
+        notification = get_payload_template("notification.json")
 
         # Fill infos. that must be personalized
         data_replacement = {
@@ -192,15 +315,15 @@ class QuerySender:
         )
         notification["channel"] = user_object.slack_userid
 
-        # The headers must also include an authorization token for the chats API
-        final_header = self.default_header
-        final_header["Authorization"] = (
-            "Bearer " + settings.config["SLACK_BEARER_TOKEN"]
-        )
+        # And post; failures are reported rather than raised, so that other users are notified
+        try:
+            res = self.post(settings.config["SLACK_CHAT_API_URL"], notification).json()
+        except (_requests().RequestException, ValueError):
+            logger.exception(f"Error while notifying {user_object.first_name}")
+            return False
 
-        # And post
-        requests.post(
-            settings.config["SLACK_CHAT_API_URL"],
-            data=json.dumps(notification),
-            headers=final_header,
-        )
+        if res.get("ok") is not True:
+            logger.error(res)
+            return False
+
+        return True
@@ -0,0 +1,295 @@
+import datetime
+import heapq
+import logging
+import pytz
+import timesheetbot.settings as settings
+
+from collections import defaultdict
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connection, connections
+from django.db.models import Max, Min
+from django.utils import timezone
+from timesheetbot.models import NotificationHour, User
+from timesheetbot.utils import metrics
+from timesheetbot.utils.bulk_user_analyzer import (
+    BulkUserAnalyzer,
+    maintain_users_analysis_mindate,
+)
+from timesheetbot.utils.google_sheet_writer import (
+    GoogleSheetWriter,
+    get_time_entries_to_write,
+    is_auth_error,
+)
+from timesheetbot.utils.off_slot_reader import OffSlotReader
+
+logger = logging.getLogger(__name__)
+
+# Identifies the scheduler among the advisory locks of the database
+SCHEDULER_LOCK_KEY = 7473626
+
+
+def compute_next_notification_time(working_timezone, notification_hours, after):
+    """First time strictly after `after` at which local time is one of the notification hours, or None"""
+
+    tz = pytz.timezone(working_timezone)
+    local_date = after.astimezone(tz).date()
+
+    # Localizing wall-clock times keeps DST changes into account
+    for day_num in range(3):
+        for hour in sorted(notification_hours):
+            notification_time = tz.normalize(
+                tz.localize(
+                    datetime.datetime.combine(
+                        local_date + datetime.timedelta(days=day_num),
+                        datetime.time(hour),
+                    )
+                )
+            )
+            if notification_time > after:
+                return notification_time
+
+    return None
+
+
+class AdvisoryLock:
+    """Postgres session advisory lock, held on a dedicated connection while it lives"""
+
+    def __init__(self, key):
+        self.key = key
+        self.connection = None
+        self.is_held = False
+
+    def acquire(self):
+        """Takes the lock if free; returns whether it is held"""
+
+        try:
+            if self.connection is None:
+                self.connection = connections.create_connection(DEFAULT_DB_ALIAS)
+
+            # Other databases are only used for development, without replicas
+            if self.connection.vendor != "postgresql":
+                self.is_held = True
+                return self.is_held
+
+            with self.connection.cursor() as cursor:
+                if self.is_held:
+                    # The lock lives as long as the session: check it is still alive
+                    cursor.execute("SELECT 1")
+                else:
+                    cursor.execute("SELECT pg_try_advisory_lock(%s)", [self.key])
+                    self.is_held = cursor.fetchone()[0]
+        except DatabaseError:
+            logger.exception("Error while acquiring the scheduler lock")
+            self.release()
+
+        return self.is_held
+
+    def release(self):
+        """Unlocks explicitly, as a pooled connection outlives its closing; a closed session releases the lock anyway"""
+
+        if self.connection is not None:
+            try:
+                if self.is_held and self.connection.vendor == "postgresql":
+                    with self.connection.cursor() as cursor:
+                        cursor.execute("SELECT pg_advisory_unlock(%s)", [self.key])
+            except DatabaseError:
+                pass
+            try:
+                self.connection.close()
+            except DatabaseError:
+                pass
+        self.connection = None
+        self.is_held = False
+
+
+class Scheduler:
+    """Sends each user's notifications at their time and writes new entries soon after their submission"""
+
+    def __init__(self):
+        """Nothing is loaded until the scheduler leads"""
+
+        self.notification_queue = []
+        self.next_refresh_time = None
+        # Notifications due up to that time have been sent
+        self.notified_until = None
+        self.sheet_writer = None
+        # Consecutive Sheets failures, and when the sheet may be tried again
+        self.sheet_failure_count = 0
+        self.next_sheet_attempt_time = None
+        self.last_report_hour = None
+
+    def refresh_notification_queue(self, current_time):
+        """Rebuilds the queue of next notification times, to follow users & hours changes"""
+
+        # When starting, notifications of the current hour are sent, unless users' last notification is recent
+        if self.notified_until is None:
+            self.notified_until = current_time.replace(
+                minute=0, second=0, microsecond=0
+            ) - datetime.timedelta(seconds=1)
+
+        notification_hours = defaultdict(set)
+        for one_hour in NotificationHour.objects.values("user_id", "timezone_hour"):
+            notification_hours[one_hour["user_id"]].add(one_hour["timezone_hour"])
+
+        self.notification_queue = []
+        for user_id, working_timezone in User.objects.values_list(
+            "pk", "working_timezone"
+        ):
+            if user_id in notification_hours:
+                notification_time = compute_next_notification_time(
+                    working_timezone, notification_hours[user_id], self.notified_until
+                )
+                if notification_time is not None:
+                    self.notification_queue.append((notification_time, user_id))
+        heapq.heapify(self.notification_queue)
+
+        self.next_refresh_time = current_time + datetime.timedelta(
+            seconds=settings.config["SCHEDULER_REFRESH_SECONDS"]
+        )
+
+    def send_due_notifications(self, current_time):
+        """Notifies all users whose notification time has come"""
+
+        due_user_ids = []
+        while (
+            len(self.notification_queue)
+            and self.notification_queue[0][0] <= current_time
+        ):
+            due_user_ids.append(heapq.heappop(self.notification_queue)[1])
+        self.notified_until = current_time
+        if not len(due_user_ids):
+            return
+
+        bulk_user_analyzer = BulkUserAnalyzer(User.objects.filter(pk__in=due_user_ids))
+        try:
+            bulk_user_analyzer.launch_notifications()
+            bulk_user_analyzer.update_users_analysis_mindate()
+        finally:
+            bulk_user_analyzer.save()
+
+        # Then their next notification
+        for user in bulk_user_analyzer.users:
+            notification_time = compute_next_notification_time(
+                user.working_timezone,
+                bulk_user_analyzer.notification_hours[user.pk],
+                current_time,
+            )
+            if notification_time is not None:
+                heapq.heappush(self.notification_queue, (notification_time, user.pk))
+
+    def get_sheet_writer(self):
+        """The Sheets client is kept warm between uses"""
+
+        if self.sheet_writer is None:
+            self.sheet_writer = GoogleSheetWriter()
+
+        return self.sheet_writer
+
+    def is_sheet_backing_off(self, current_time):
+        """Whether the sheet failed lately, and must not be tried again yet"""
+
+        return (
+            self.next_sheet_attempt_time is not None
+            and current_time < self.next_sheet_attempt_time
+        )
+
+    def record_sheet_result(self, current_time, error=None):
+        """Backs off exponentially while the sheet keeps failing; the client is only replaced after auth errors"""
+
+        if error is None:
+            self.sheet_failure_count = 0
+            self.next_sheet_attempt_time = None
+            return
+
+        self.sheet_failure_count += 1
+        backoff_seconds = min(
+            settings.config["SCHEDULER_SHEET_MAX_BACKOFF_SECONDS"],
+            settings.config["SCHEDULER_SHEET_BACKOFF_SECONDS"]
+            * 2 ** (self.sheet_failure_count - 1),
+        )
+        self.next_sheet_attempt_time = current_time + datetime.timedelta(
+            seconds=backoff_seconds
+        )
+        logger.warning(
+            f"Sheet failed {self.sheet_failure_count} times in a row, next attempt in {backoff_seconds}s"
+        )
+
+        # Otherwise the client and its opened spreadsheet are kept warm
+        if is_auth_error(error):
+            self.sheet_writer = None
+
+    def refresh_off_slots(self, current_time):
+        """Reads days off from sheets changed since the last reading; known ones are kept on errors"""
+
+        if self.is_sheet_backing_off(current_time):
+            return
+
+        try:
+            OffSlotReader(self.get_sheet_writer()).refresh()
+        except Exception as error:
+            logger.exception("Error while reading days off from the sheet")
+            self.record_sheet_result(current_time, error)
+        else:
+            self.record_sheet_result(current_time)
+
+    def flush_sheet_writes(self, current_time):
+        """Writes pending entries once users stopped submitting for a while, or once they waited too long"""
+
+        pending = get_time_entries_to_write().aggregate(
+            oldest=Min("modification_time"), newest=Max("modification_time")
+        )
+        if pending["newest"] is None or self.is_sheet_backing_off(current_time):
+            return
+
+        if current_time - pending["newest"] < datetime.timedelta(
+            seconds=settings.config["SCHEDULER_SHEET_DEBOUNCE_SECONDS"]
+        ) and current_time - pending["oldest"] < datetime.timedelta(
+            seconds=settings.config["SCHEDULER_SHEET_MAX_DELAY_SECONDS"]
+        ):
+            return
+
+        try:
+            self.get_sheet_writer().write_all_new_data()
+        except Exception as error:
+            self.record_sheet_result(current_time, error)
+            raise
+        self.record_sheet_result(current_time)
+
+    def run_once(self):
+        """A scheduler step, while leading"""
+
+        current_time = timezone.now()
+        if self.next_refresh_time is None or current_time >= self.next_refresh_time:
+            self.refresh_off_slots(current_time)
+            self.refresh_notification_queue(current_time)
+
+        self.send_due_notifications(current_time)
+        maintain_users_analysis_mindate(current_time)
+        self.flush_sheet_writes(current_time)
+
+        if self.last_report_hour != current_time.hour:
+            metrics.report_metrics("scheduler")
+            self.last_report_hour = current_time.hour
+
+    def run(self, stop_event):
+        """Main loop: only the replica holding the lock acts, others wait to take over"""
+
+        lock = AdvisoryLock(SCHEDULER_LOCK_KEY)
+        try:
+            while not stop_event.is_set():
+                if lock.acquire():
+                    try:
+                        self.run_once()
+                    except Exception:
+                        logger.exception("Error during a scheduler step")
+                        # A broken connection is replaced by the next step
+                        connection.close()
+                else:
+                    # Followers start from scratch when they take over
+                    self.next_refresh_time = None
+                    self.notified_until = None
+                    self.sheet_writer = None
+                    self.record_sheet_result(None)
+
+                stop_event.wait(settings.config["SCHEDULER_POLL_SECONDS"])
+        finally:
+            lock.release()
@@ -0,0 +1,120 @@
+import logging
+import random
+import threading
+import time
+import timesheetbot.settings as settings
+
+from timesheetbot.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Not processed by Google: retried whatever the call
+RATE_LIMITED_STATUS = 429
+# Failed on Google's side: only retried when a call can be repeated safely
+SERVER_ERROR_STATUSES = (500, 502, 503, 504)
+
+
+class TokenBucket:
+    """Allows a number of requests per minute, in bursts of at most `capacity` requests"""
+
+    def __init__(self, requests_per_minute, capacity):
+        self.rate = requests_per_minute / 60
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Takes a token, waiting for one if needed; returns the time waited, in seconds"""
+
+        with self.lock:
+            current_time = time.monotonic()
+            self.tokens = min(
+                self.capacity,
+                self.tokens + (current_time - self.last_time) * self.rate,
+            )
+            self.last_time = current_time
+
+            # The token is taken in advance: next callers wait after this one
+            self.tokens -= 1
+            wait_time = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+        return wait_time
+
+
+def is_repeatable_call(method, endpoint):
+    """Reads and cell values writes give the same result when repeated, unlike sheets creation"""
+
+    return method == "get" or "/values" in endpoint
+
+
+class SheetsRequestScheduler:
+    """Paces Google API calls under the per-minute quota, retrying rate limited & failed ones with exponential backoff"""
+
+    def __init__(self):
+        self.bucket = TokenBucket(
+            settings.config["GSPREAD_REQUESTS_PER_MINUTE"],
+            settings.config["GSPREAD_BURST_REQUESTS"],
+        )
+        self.reset_summary()
+
+    def reset_summary(self):
+        """Starts counting the requests of a new run"""
+
+        self.request_count = 0
+        self.retry_count = 0
+        self.quota_wait_seconds = 0.0
+        self.backoff_wait_seconds = 0.0
+
+    def get_backoff_seconds(self, attempt_num, response):
+        """Exponential delay with jitter, or the delay asked by Google if longer"""
+
+        backoff_seconds = min(
+            settings.config["GSPREAD_MAX_BACKOFF_SECONDS"],
+            settings.config["GSPREAD_BACKOFF_SECONDS"] * 2**attempt_num,
+        ) * random.uniform(0.5, 1)
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is not None and retry_after.isdigit():
+            backoff_seconds = max(backoff_seconds, int(retry_after))
+
+        return backoff_seconds
+
+    def request(self, send_request, method, endpoint, *args, **kwargs):
+        """Sends a request with gspread's `send_request`, once quota allows, retrying on 429 and 5xx"""
+
+        # gspread is only imported by processes using the sheet
+        from gspread.exceptions import APIError
+
+        attempt_num = 0
+        while True:
+            quota_wait_seconds = self.bucket.acquire()
+            self.quota_wait_seconds += quota_wait_seconds
+            metrics.gsheet_wait_seconds_total.inc("quota", amount=quota_wait_seconds)
+            self.request_count += 1
+            try:
+                return send_request(method, endpoint, *args, **kwargs)
+            except APIError as error:
+                status = error.response.status_code
+                if attempt_num >= settings.config["GSPREAD_MAX_RETRIES"] or not (
+                    status == RATE_LIMITED_STATUS
+                    or (
+                        status in SERVER_ERROR_STATUSES
+                        and is_repeatable_call(method, endpoint)
+                    )
+                ):
+                    raise
+
+                backoff_seconds = self.get_backoff_seconds(attempt_num, error.response)
+
+            attempt_num += 1
+            self.retry_count += 1
+            self.backoff_wait_seconds += backoff_seconds
+            metrics.gsheet_retries_total.inc(f"http_{status}")
+            metrics.gsheet_wait_seconds_total.inc("backoff", amount=backoff_seconds)
+            logger.warning(
+                f"Google API answered {status}, retrying in {backoff_seconds:.1f}s"
+            )
+            time.sleep(backoff_seconds)
@@ -2,12 +2,19 @@ import datetime
 import json
 import re
 import logging
+import time
 
 from timesheetbot.models import User
+from timesheetbot.utils import metrics
+from timesheetbot.utils.query_sender import WEEK_MODAL_CALLBACK_ID
+from timesheetbot.utils.time_slot import get_time_slot_fields
 from timesheetbot.utils.user_analyzer import UserAnalyzer
 
 logger = logging.getLogger(__name__)
 
+# Set by the webhook on submissions it already answered with the next modal
+NEXT_MODAL_SENT_KEY = "timesheetbot_next_modal_sent"
+
 
 def parse_modal_date(date_as_text: str):
     """Parses date as displayed in modals to get a datetime object + morning/afternoon info."""
@@ -38,14 +45,35 @@ def parse_modal_date(date_as_text: str):
     }
 
 
+def get_selected_time_slots(view):
+    """Time slots checked in a submitted week modal"""
+
+    return [
+        int(option["value"])
+        for option in view["state"]["values"]["time-slots-block"]["time-slots-action"][
+            "selected_options"
+        ]
+    ]
+
+
+def is_week_modal(view):
+    return view.get("callback_id") == WEEK_MODAL_CALLBACK_ID
+
+
 class SlackAnalyzer:
     """Parser for Slack request"""
 
-    def __init__(self, json_path):
+    def __init__(self, request_data):
         """Initial loading"""
 
+        self.request_data = request_data
+
+    @classmethod
+    def from_json_file(cls, json_path):
+        """Builds an analyzer from a json encoded request saved on disk"""
+
         with open(json_path, "r") as hr:
-            self.request_data = json.load(hr)
+            return cls(json.load(hr))
 
     def analyze_and_respond(self):
         """Initial data parsing / routing"""
@@ -80,25 +108,55 @@ class SlackAnalyzer:
         """Parsing a submission request"""
 
         # Hence: register changes; then, launch new modal if necessary
-        self.handle_data_modification("submit")
-        self.user_analyzer.launch_modals(self.triggered_uid)
+        if is_week_modal(self.request_data["view"]):
+            self.user_analyzer.register_week_changes(
+                get_selected_time_slots(self.request_data["view"]),
+                self.request_data["view"]["state"]["values"],
+            )
+            if not self.request_data.get(NEXT_MODAL_SENT_KEY):
+                self.launch_modals(week=True)
+        else:
+            self.handle_data_modification("submit")
+            if not self.request_data.get(NEXT_MODAL_SENT_KEY):
+                self.launch_modals()
 
     def handle_button_clicked(self):
         """Parsing a block element action"""
 
         # Either a button => only launching modals / or select change => only registering changes
         if self.request_data["actions"][0]["type"] == "button":
-            self.user_analyzer.launch_modals(self.triggered_uid)
+            self.launch_modals(
+                week=self.request_data["actions"][0].get("action_id")
+                == "notification-week-button-click"
+            )
         elif self.request_data["actions"][0]["type"] == "static_select":
             self.handle_data_modification("select")
 
+    def launch_modals(self, week=False):
+        """Opens the next modal, measuring how close to expiry the trigger id got"""
+
+        if week:
+            is_modal_sent = self.user_analyzer.launch_week_modal(self.triggered_uid)
+        else:
+            is_modal_sent = self.user_analyzer.launch_modals(self.triggered_uid)
+
+        if is_modal_sent and metrics.RECEPTION_TIME_KEY in self.request_data:
+            metrics.slack_trigger_age_seconds.observe(
+                time.time() - self.request_data[metrics.RECEPTION_TIME_KEY]
+            )
+
     def handle_data_modification(self, action_type="submit"):
         """Wrapper to register modification to Users data"""
 
-        # Parse the date and select relevant query portion
-        data_concerned_date = parse_modal_date(
-            self.request_data["view"]["blocks"][2]["label"]["text"]
-        )
+        # Retrieve the time slot and select relevant query portion
+        # Modals sent before time slots were attached only hold it in their label
+        private_metadata = self.request_data["view"].get("private_metadata")
+        if private_metadata:
+            data_concerned_date = get_time_slot_fields(int(private_metadata))
+        else:
+            data_concerned_date = parse_modal_date(
+                self.request_data["view"]["blocks"][2]["label"]["text"]
+            )
         if action_type == "submit":
             changes = self.request_data["view"]["state"]["values"]
 
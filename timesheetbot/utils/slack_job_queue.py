@@ -0,0 +1,151 @@
+import datetime
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from timesheetbot.models import SlackJob
+from timesheetbot.utils import metrics
+from timesheetbot.utils.slack_analyzer import SlackAnalyzer
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_slack_job(request_data):
+    """Persists a Slack payload so that a consumer handles it later"""
+
+    SlackJob.objects.create(payload=request_data)
+
+
+def claim_slack_jobs(batch_size):
+    """Marks up to `batch_size` pending jobs as running and returns them"""
+
+    # Rows locked by another consumer are skipped rather than waited for
+    with transaction.atomic():
+        jobs = list(
+            SlackJob.objects.select_for_update(skip_locked=True)
+            .filter(status=SlackJob.STATUS_PENDING)
+            .order_by("id")[:batch_size]
+        )
+        if jobs:
+            SlackJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                status=SlackJob.STATUS_RUNNING,
+                start_time=timezone.now(),
+                attempts=F("attempts") + 1,
+            )
+
+    return jobs
+
+
+def requeue_stale_slack_jobs(stale_after_seconds, max_attempts):
+    """Jobs running for too long belong to a dead consumer: retry them, or give up"""
+
+    stale_jobs = SlackJob.objects.filter(
+        status=SlackJob.STATUS_RUNNING,
+        start_time__lt=timezone.now() - datetime.timedelta(seconds=stale_after_seconds),
+    )
+
+    requeued_count = stale_jobs.filter(attempts__lt=max_attempts).update(
+        status=SlackJob.STATUS_PENDING
+    )
+    failed_count = stale_jobs.update(
+        status=SlackJob.STATUS_FAILED, error="Consumer did not complete the job"
+    )
+
+    if requeued_count or failed_count:
+        logger.warning(
+            f"Stale Slack jobs: {requeued_count} requeued, {failed_count} given up"
+        )
+
+
+def purge_failed_slack_jobs(retention_days):
+    """Failed jobs are kept for investigation, then deleted; done ones are deleted right away"""
+
+    deleted_count, _ = SlackJob.objects.filter(
+        status=SlackJob.STATUS_FAILED,
+        creation_time__lt=timezone.now() - datetime.timedelta(days=retention_days),
+    ).delete()
+
+    if deleted_count:
+        logger.info(f"{deleted_count} failed Slack jobs purged")
+
+
+def get_queue_depth():
+    """Returns the number of jobs per status"""
+
+    depth = {
+        SlackJob.STATUS_PENDING: 0,
+        SlackJob.STATUS_RUNNING: 0,
+        SlackJob.STATUS_FAILED: 0,
+    }
+    for one_status in SlackJob.objects.values("status").annotate(count=Count("id")):
+        depth[one_status["status"]] = one_status["count"]
+
+    return depth
+
+
+def handle_slack_job(job):
+    """Handles a claimed job, in a thread of its consumer's pool; returns its error, if any"""
+
+    # Each pool thread keeps its own connection, dropped once unusable or too old
+    close_old_connections()
+    metrics.observe_request_wait(job.payload, "queue")
+    try:
+        SlackAnalyzer(job.payload).analyze_and_respond()
+    except Exception as e:
+        logger.exception(f"Slack job {job.pk} failed")
+        return e
+
+    return None
+
+
+class SlackJobConsumer(threading.Thread):
+    """Thread consuming Slack jobs by batches until asked to stop"""
+
+    def __init__(self, name, batch_size, poll_interval, stop_event):
+        """Initialization: consumers of a same process share the stop event"""
+
+        super().__init__(name=name, daemon=True)
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.stop_event = stop_event
+
+    def run(self):
+        """Consumer loop: claims a batch, handles it, then looks for more
+
+        Jobs of a batch are handled in parallel: a job whose trigger id expires within seconds never waits behind
+        slow jobs of its batch.
+        """
+
+        with ThreadPoolExecutor(
+            max_workers=self.batch_size, thread_name_prefix=self.name
+        ) as executor:
+            while not self.stop_event.is_set():
+                close_old_connections()
+                try:
+                    jobs = claim_slack_jobs(self.batch_size)
+                    if jobs:
+                        self.handle_jobs(executor, jobs)
+                        continue
+                except Exception:
+                    logger.exception(f"Error in Slack job consumer {self.name}")
+
+                self.stop_event.wait(self.poll_interval)
+
+        connection.close()
+
+    def handle_jobs(self, executor, jobs):
+        """Handles claimed jobs in parallel; successful ones are removed all at once"""
+
+        done_job_ids = []
+        for job, error in zip(jobs, executor.map(handle_slack_job, jobs)):
+            if error is None:
+                done_job_ids.append(job.pk)
+            else:
+                SlackJob.objects.filter(pk=job.pk).update(
+                    status=SlackJob.STATUS_FAILED, error=repr(error)
+                )
+
+        SlackJob.objects.filter(pk__in=done_job_ids).delete()
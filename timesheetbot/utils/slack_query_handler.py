@@ -1,6 +1,7 @@
 import hashlib
 import hmac
 import json
+import logging
 import os
 import subprocess
 import sys
@@ -12,6 +13,17 @@ import urllib.parse
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse
+from timesheetbot.models import User
+from timesheetbot.utils import metrics
+from timesheetbot.utils.query_sender import WEEK_MODAL_MAX_TIME_SLOTS
+from timesheetbot.utils.slack_analyzer import (
+    NEXT_MODAL_SENT_KEY,
+    get_selected_time_slots,
+    is_week_modal,
+)
+from timesheetbot.utils.user_analyzer import UserAnalyzer
+
+logger = logging.getLogger(__name__)
 
 
 def launch_independent_async_handling_process(data):
@@ -34,19 +46,111 @@ def launch_independent_async_handling_process(data):
     )
 
 
+def dispatch_async_handling(data):
+    """Hands the payload over to the configured handling backend"""
+
+    handling_mode = settings.config["SLACK_HANDLING_MODE"]
+    if handling_mode == "thread_pool":
+        # Imported here so that the subprocess mode never starts any thread
+        from timesheetbot.utils.slack_worker_pool import get_worker_pool
+
+        # Back-pressure: the webhook waits a bit for a free slot rather than piling up work
+        if not get_worker_pool().submit(
+            data, settings.config["SLACK_WORKER_QUEUE_TIMEOUT_SECONDS"]
+        ):
+            # Still full: the user's action is handled by a separate process rather than lost
+            metrics.slack_worker_queue_full_total.inc()
+            logger.warning(
+                f"Slack worker queue is full, handling a {data['type']} request in a subprocess"
+            )
+            launch_independent_async_handling_process(data)
+    elif handling_mode == "queue":
+        from timesheetbot.utils.slack_job_queue import enqueue_slack_job
+
+        enqueue_slack_job(data)
+    elif handling_mode == "subprocess":
+        launch_independent_async_handling_process(data)
+    else:
+        raise ValueError(f"Unknown SLACK_HANDLING_MODE {handling_mode}")
+
+
+def build_submission_response(data):
+    """Answers a submission with the modal of the next missing time slot(s), sparing a views.open call"""
+
+    try:
+        if is_week_modal(data["view"]):
+            submitted_time_slots = get_selected_time_slots(data["view"])
+        else:
+            submitted_time_slots = [int(data["view"]["private_metadata"])]
+
+        # Invalid submissions are reported by the asynchronous handling, which asks again
+        if (
+            data["view"]["state"]["values"]["program-block"]["program-action"][
+                "selected_option"
+            ]
+            is None
+        ):
+            return {"response_action": "clear"}
+
+        user_analyzer = UserAnalyzer(
+            User.objects.filter(slack_userid=data["user"]["id"])
+            .values("pk")
+            .get()["pk"]
+        )
+
+        # Submitted time slots are only stored afterwards, asynchronously
+        # The next modal is of the same kind as the submitted one
+        if is_week_modal(data["view"]):
+            next_time_slots = user_analyzer.find_next_missing_time_slots(
+                WEEK_MODAL_MAX_TIME_SLOTS, submitted_time_slots
+            )
+            if len(next_time_slots):
+                view_data = user_analyzer.query_sender.prepare_week_modal(
+                    next_time_slots
+                )
+        else:
+            next_time_slots = user_analyzer.find_next_missing_time_slots(
+                1, submitted_time_slots
+            )
+            if len(next_time_slots):
+                view_data = user_analyzer.query_sender.prepare_modal(
+                    user_analyzer.user.pk, next_time_slots[0]
+                )
+    except Exception:
+        logger.exception(
+            "Error while preparing the next modal, it will be opened asynchronously"
+        )
+        return {"response_action": "clear"}
+
+    # Either way, the asynchronous handling has no modal to open anymore
+    data[NEXT_MODAL_SENT_KEY] = True
+    if not len(next_time_slots):
+        return {"response_action": "clear"}
+
+    return {"response_action": "update", "view": view_data}
+
+
 @require_POST
 @csrf_exempt
 def handle_slack(request):
     """Receives posted data, handles encoding/dispatching"""
 
+    start_time = time.perf_counter()
+    response_data = {"response_action": "clear"}
     decoded_body = request.body.decode("utf-8")
     if decoded_body.startswith("payload="):
         try:
             # Verify signature to prove that data is indeed generated by Slack
+            if (
+                "X-Slack-Request-Timestamp" not in request.headers
+                or "X-Slack-Signature" not in request.headers
+            ):
+                metrics.signature_failures_total.inc("missing_header")
             request_timestamp = request.headers["X-Slack-Request-Timestamp"]
             if time.time() > float(
                 settings.config["SLACK_QUERY_MAX_AGE_SECONDS"]
             ) + float(request_timestamp):
+                metrics.signature_failures_total.inc("too_old")
                 raise ValueError("Query is too old hence suspect")
             data_signature = (
                 "v0="
@@ -57,6 +161,7 @@ def handle_slack(request):
                 ).hexdigest()
             )
             if not (data_signature == request.headers["X-Slack-Signature"]):
+                metrics.signature_failures_total.inc("bad_signature")
                 raise ValueError("Query is not correctly signed")
 
             data_as_dict = json.loads(urllib.parse.unquote_plus(decoded_body[8:]))
@@ -65,11 +170,18 @@ def handle_slack(request):
                     data_as_dict["type"] == "block_actions"
                 ):
                     # Taken actions will (generally) be executed after the response
-                    launch_independent_async_handling_process(data_as_dict)
+                    metrics.stamp_reception(data_as_dict)
+                    if (
+                        data_as_dict["type"] == "view_submission"
+                        and settings.config["SLACK_INLINE_NEXT_MODAL"]
+                    ):
+                        response_data = build_submission_response(data_as_dict)
+                    dispatch_async_handling(data_as_dict)
                 else:
                     raise ValueError("Unexpected data type")
         except (KeyError, ValueError, json.decoder.JSONDecodeError) as e:
             pass
 
     # Actually, to avoid difficulties, let's always content Slack and deal here with problems
-    return JsonResponse({"response_action": "clear"}, status=200)
+    metrics.webhook_seconds.observe(time.perf_counter() - start_time)
+    return JsonResponse(response_data, status=200)
@@ -0,0 +1,76 @@
+import logging
+import queue
+import threading
+import timesheetbot.settings as settings
+
+from django.db import close_old_connections
+from timesheetbot.utils import metrics
+from timesheetbot.utils.slack_analyzer import SlackAnalyzer
+
+logger = logging.getLogger(__name__)
+
+
+class SlackWorkerPool:
+    """Long-lived threads analyzing Slack payloads inside the web process"""
+
+    def __init__(self, thread_count, queue_size):
+        """Starts the worker threads, all consuming a single bounded queue"""
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.threads = []
+        for thread_num in range(thread_count):
+            thread = threading.Thread(
+                target=self.work,
+                name=f"slack-worker-{thread_num}",
+                daemon=True,
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, request_data, timeout):
+        """Queues a payload; returns False if the queue stayed full for `timeout` seconds"""
+
+        try:
+            self.queue.put(request_data, timeout=timeout)
+        except queue.Full:
+            return False
+
+        return True
+
+    def work(self):
+        """Worker loop: handles payloads one at a time, forever"""
+
+        while True:
+            request_data = self.queue.get()
+            metrics.observe_request_wait(request_data, "thread_pool")
+
+            # Threads outlive requests, hence Django won't recycle their connections for us
+            close_old_connections()
+            try:
+                SlackAnalyzer(request_data).analyze_and_respond()
+            except Exception:
+                logger.exception(
+                    "Error while handling a Slack request in a worker thread"
+                )
+            finally:
+                close_old_connections()
+                self.queue.task_done()
+
+
+_worker_pool = None
+_worker_pool_lock = threading.Lock()
+
+
+def get_worker_pool():
+    """Returns the process-wide pool, created on first use (hence after gunicorn forks)"""
+
+    global _worker_pool
+
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            _worker_pool = SlackWorkerPool(
+                settings.config["SLACK_WORKER_THREADS"],
+                settings.config["SLACK_WORKER_QUEUE_SIZE"],
+            )
+
+    return _worker_pool
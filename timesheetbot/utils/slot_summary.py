@@ -0,0 +1,231 @@
+import datetime
+import pytz
+import timesheetbot.settings as settings
+
+from collections import defaultdict
+from django.db import transaction
+from timesheetbot.models import OffSlot, TimeEntry, User, UserSlotSummary
+from timesheetbot.utils.time_slot import (
+    get_time_slot,
+    get_time_slot_date,
+    get_working_time_slots_between,
+)
+
+SUMMARY_FIELDS = [
+    "analysis_start",
+    "needed_until_time_slot",
+    "missing_time_slots",
+    "missing_count",
+    "first_missing_time_slot",
+    "last_filled_time_slot",
+    "update_time",
+]
+
+
+def compute_needed_until(user):
+    """First time slot not needed yet: today's half-days are needed once over in the user's timezone"""
+
+    needed_until = get_time_slot(datetime.date.today(), True)
+    current_tz_hour = datetime.datetime.now(
+        tz=pytz.timezone(user.working_timezone)
+    ).hour
+    if current_tz_hour >= settings.config["MORNING_ENDS_AT"]:
+        needed_until += 1
+    if current_tz_hour >= settings.config["AFTERNOON_ENDS_AT"]:
+        needed_until += 1
+
+    return needed_until
+
+
+def load_time_slots(first_time_slots):
+    """Filled and off time slots of users, from a first time slot per user id; two queries in all"""
+
+    filled_time_slots = defaultdict(set)
+    off_time_slots = defaultdict(set)
+    if not len(first_time_slots):
+        return filled_time_slots, off_time_slots
+
+    # A single scan per table, from the oldest starting point: earlier rows are dropped per user
+    first_date = get_time_slot_date(min(first_time_slots.values()))
+    for time_slots, queryset in (
+        (filled_time_slots, TimeEntry.objects.filter(program__isnull=False)),
+        (off_time_slots, OffSlot.objects.all()),
+    ):
+        for one_data in queryset.filter(
+            date__gte=first_date, user_id__in=list(first_time_slots)
+        ).values("user_id", "date", "is_morning"):
+            time_slot = get_time_slot(one_data["date"], one_data["is_morning"])
+            if time_slot >= first_time_slots[one_data["user_id"]]:
+                time_slots[one_data["user_id"]].add(time_slot)
+
+    return filled_time_slots, off_time_slots
+
+
+def set_missing_time_slots(summary, missing_time_slots):
+    """Stores missing time slots, and the counters derived from them"""
+
+    summary.missing_time_slots = sorted(missing_time_slots)
+    summary.missing_count = len(summary.missing_time_slots)
+    summary.first_missing_time_slot = (
+        summary.missing_time_slots[0] if summary.missing_count else None
+    )
+
+
+def roll_over(summary, needed_until, filled_time_slots, off_time_slots):
+    """Accounts for the time slots needed since the summary horizon, given filled/off ones from there"""
+
+    set_missing_time_slots(
+        summary,
+        set(summary.missing_time_slots)
+        | (
+            get_working_time_slots_between(summary.needed_until_time_slot, needed_until)
+            - filled_time_slots
+            - off_time_slots
+        ),
+    )
+    if len(filled_time_slots):
+        summary.last_filled_time_slot = max(
+            filled_time_slots | {summary.last_filled_time_slot or 0}
+        )
+    summary.needed_until_time_slot = max(summary.needed_until_time_slot, needed_until)
+
+
+def lock_users(user_ids):
+    """Serializes summary changes per user, until the end of the transaction
+
+    A summary built from entries read before a concurrent fill commits would otherwise keep its slot missing.
+    """
+
+    # Always locked in the same order, against deadlocks
+    list(
+        User.objects.select_for_update()
+        .filter(pk__in=user_ids)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+
+
+def get_slot_summaries(users):
+    """Up to date summaries of users, by user id: built if missing, rolled over if time passed
+
+    Whatever the number of users, a constant number of queries is run.
+    """
+
+    with transaction.atomic():
+        lock_users([user.pk for user in users])
+        summaries = {
+            summary.user_id: summary
+            for summary in UserSlotSummary.objects.filter(user__in=users)
+        }
+
+        first_time_slots = {}
+        needed_untils = {}
+        changed_user_ids = set()
+        for user in users:
+            summary = summaries.get(user.pk)
+            # Built from scratch: an empty summary, rolled over from the analysis start
+            if (
+                summary is None
+                or summary.analysis_start != user.look_for_data_starting_at
+            ):
+                summary = UserSlotSummary(
+                    user=user,
+                    analysis_start=user.look_for_data_starting_at,
+                    needed_until_time_slot=get_time_slot(
+                        user.look_for_data_starting_at, True
+                    ),
+                )
+                summaries[user.pk] = summary
+                changed_user_ids.add(user.pk)
+
+            needed_untils[user.pk] = compute_needed_until(user)
+            if summary.needed_until_time_slot < needed_untils[user.pk]:
+                first_time_slots[user.pk] = summary.needed_until_time_slot
+                changed_user_ids.add(user.pk)
+
+        filled_time_slots, off_time_slots = load_time_slots(first_time_slots)
+        for user_id in first_time_slots:
+            roll_over(
+                summaries[user_id],
+                needed_untils[user_id],
+                filled_time_slots[user_id],
+                off_time_slots[user_id],
+            )
+
+        save_slot_summaries([summaries[user_id] for user_id in changed_user_ids])
+
+    return summaries
+
+
+def save_slot_summaries(summaries):
+    """Single statement: new summaries are inserted, existing ones are updated"""
+
+    if len(summaries):
+        UserSlotSummary.objects.bulk_create(
+            summaries,
+            update_conflicts=True,
+            unique_fields=["user"],
+            update_fields=SUMMARY_FIELDS,
+        )
+
+
+def mark_time_slots_filled(user_id, time_slots):
+    """Time slots of a user have been filled: they are not missing anymore"""
+
+    with transaction.atomic():
+        lock_users([user_id])
+        summary = UserSlotSummary.objects.filter(user_id=user_id).first()
+        # Built on its first use, from entries committed by then
+        if summary is None:
+            return
+
+        set_missing_time_slots(
+            summary, set(summary.missing_time_slots) - set(time_slots)
+        )
+        tracked_time_slots = [
+            time_slot
+            for time_slot in time_slots
+            if time_slot >= get_time_slot(summary.analysis_start, True)
+        ]
+        if len(tracked_time_slots):
+            summary.last_filled_time_slot = max(
+                tracked_time_slots + [summary.last_filled_time_slot or 0]
+            )
+        summary.save()
+
+
+def forget_slot_summaries(user_ids):
+    """Summaries that can't be updated incrementally are dropped, and built again on their next use"""
+
+    with transaction.atomic():
+        lock_users(user_ids)
+        UserSlotSummary.objects.filter(user_id__in=user_ids).delete()
+
+
+def move_analysis_start(summary, analysis_start):
+    """Follows the user's analysis starting point, which never goes past the first missing slot"""
+
+    summary.analysis_start = analysis_start
+    if (
+        summary.last_filled_time_slot is not None
+        and summary.last_filled_time_slot < get_time_slot(analysis_start, True)
+    ):
+        summary.last_filled_time_slot = None
+
+
+def save_moved_analysis_starts(summaries):
+    """Moves the analysis start of stored summaries, re-read so that concurrent fills are kept"""
+
+    analysis_starts = {summary.user_id: summary.analysis_start for summary in summaries}
+    if not len(analysis_starts):
+        return
+
+    with transaction.atomic():
+        lock_users(list(analysis_starts))
+        # Summaries forgotten since are built again on their next use
+        stored_summaries = list(
+            UserSlotSummary.objects.filter(user_id__in=list(analysis_starts))
+        )
+        for summary in stored_summaries:
+            move_analysis_start(summary, analysis_starts[summary.user_id])
+        save_slot_summaries(stored_summaries)
@@ -0,0 +1,42 @@
+import datetime
+
+# A time slot is a half-day, represented by an integer: date.toordinal() * 2 (+ 1 for the afternoon).
+# Time slots are hence ordered chronologically, and a set of them is cheap to build and to diff.
+
+
+def get_time_slot(date: datetime.date, is_morning: bool):
+    """Returns the time slot of a given half-day"""
+
+    return date.toordinal() * 2 + (0 if is_morning else 1)
+
+
+def get_time_slot_date(time_slot: int):
+    """Returns the date of a time slot"""
+
+    return datetime.date.fromordinal(time_slot // 2)
+
+
+def is_morning_time_slot(time_slot: int):
+    """Tells whether a time slot is a morning"""
+
+    return time_slot % 2 == 0
+
+
+def get_time_slot_fields(time_slot: int):
+    """Returns the TimeEntry fields identifying a time slot"""
+
+    return {
+        "date": get_time_slot_date(time_slot),
+        "is_morning": is_morning_time_slot(time_slot),
+        "is_afternoon": not is_morning_time_slot(time_slot),
+    }
+
+
+def get_working_time_slots_between(first_time_slot: int, end_time_slot: int):
+    """Returns the set of week days time slots, from first_time_slot included to end_time_slot excluded"""
+
+    return {
+        time_slot
+        for time_slot in range(first_time_slot, end_time_slot)
+        if (time_slot // 2 - 1) % 7 < 5
+    }
@@ -1,9 +1,94 @@
 import datetime
-import pytz
 import timesheetbot.settings as settings
 
-from timesheetbot.models import User, TimeEntry, WorkType, Program, NotificationHour
-from timesheetbot.utils.query_sender import QuerySender
+from django.db import transaction
+from timesheetbot.models import User, TimeEntry, WorkType, Program
+from timesheetbot.utils import metrics
+from timesheetbot.utils.payload_cache import get_cached_options
+from timesheetbot.utils.query_sender import (
+    QuerySender,
+    WEEK_MODAL_MAX_TIME_SLOTS,
+    format_date,
+)
+from timesheetbot.utils.slot_summary import (
+    compute_needed_until,
+    get_slot_summaries,
+    lock_users,
+    mark_time_slots_filled,
+)
+from timesheetbot.utils.time_slot import (
+    get_time_slot,
+    get_time_slot_date,
+    get_working_time_slots_between,
+    is_morning_time_slot,
+)
+
+
+def compute_needed_data(user: User):
+    """Find out all the time slots for which informations must be filled by user"""
+
+    # For efficiency, a starting date is regularly updated
+    # If entries are filled up to a date, start only at that date next time
+    # Also: we might expect data only up to now, week-ends excluded
+    return get_working_time_slots_between(
+        get_time_slot(user.look_for_data_starting_at, True), compute_needed_until(user)
+    )
+
+
+def can_be_notified(
+    user: User, count_missing_data: int, current_tz_time: datetime.datetime
+):
+    """At one of its notification hours, tells whether user must actually be notified"""
+
+    # We send notifications only if there are entries that actually must be filled
+    if not count_missing_data:
+        return False
+
+    # We notify only if last notification is old enough according to configuration
+    if (
+        user.last_notified
+        + datetime.timedelta(hours=user.min_hours_between_notifications)
+    ) > current_tz_time:
+        return False
+
+    # Skip notifications on WE if settings say so
+    if (settings.config["SKIP_NOTIFICATIONS_ON_WE"]) and (
+        current_tz_time.weekday() >= 5
+    ):
+        return False
+
+    return True
+
+
+def compute_analysis_mindate(first_missing_time_slot):
+    """Computes the starting point of future missing data analysis"""
+
+    if first_missing_time_slot is not None:
+        # The new starting point may be the first missing point if there are some
+        return get_time_slot_date(first_missing_time_slot)
+
+    # Else, we can start future analysis directly at the current day
+    return datetime.date.today()
+
+
+def get_work_types_by_slack_value():
+    """All work types, cached in-process until they change"""
+
+    return get_cached_options(
+        "work_types_by_slack_value",
+        lambda: {
+            work_type.slack_value: work_type for work_type in WorkType.objects.all()
+        },
+    )
+
+
+def get_programs_by_slack_value():
+    """All programs, cached in-process until they change"""
+
+    return get_cached_options(
+        "programs_by_slack_value",
+        lambda: {program.slack_value: program for program in Program.objects.all()},
+    )
 
 
 class UserAnalyzer:
@@ -15,14 +100,16 @@ class UserAnalyzer:
         self.query_sender = QuerySender()
 
     def launch_modals(self, trigger_id):
-        """Create a new filling-data modal if data are missing"""
+        """Create a new filling-data modal if data are missing; returns whether one was sent"""
         try:
-            missing_data = self.find_missing_data()
-            if len(missing_data):
+            first_missing_time_slot = self.get_slot_summary().first_missing_time_slot
+            if first_missing_time_slot is not None:
                 # Modal by default for the first missing date
                 self.query_sender.prepare_and_send_modal(
-                    trigger_id, self.user.pk, sorted(missing_data)[0]
+                    trigger_id, self.user.pk, first_missing_time_slot
                 )
+                return True
+            return False
         except:
             self.query_sender.send_simple_message(
                 ":warning: Something went wrong while generating the modal...\n"
@@ -31,116 +118,118 @@ class UserAnalyzer:
             )
             raise
 
+    def launch_week_modal(self, trigger_id):
+        """Create a modal filling several missing time slots at once, if data are missing; returns whether one was sent"""
+        try:
+            time_slots = self.find_next_missing_time_slots(WEEK_MODAL_MAX_TIME_SLOTS)
+            if len(time_slots):
+                self.query_sender.prepare_and_send_week_modal(trigger_id, time_slots)
+                return True
+            return False
+        except:
+            self.query_sender.send_simple_message(
+                ":warning: Something went wrong while generating the modal...\n"
+                + "Please inform the administrator ASAP :pray:",
+                self.user.slack_userid,
+            )
+            raise
+
+    def find_next_missing_time_slots(self, count, excluded_time_slots=()):
+        """First `count` time slots to fill, not considering the excluded ones"""
+
+        return sorted(self.find_missing_data() - set(excluded_time_slots))[:count]
+
     def find_missing_data(self):
         """Find out what entries must be filled"""
 
-        # Relies on auxilary functions, to know what should be filled minus what's already
-        return self.find_needed_data() - self.find_available_data()
-
-    def find_needed_data(self):
-        """Find out all the time slots for which informations must be filled"""
-
-        # For efficiency, a starting date is regularly updated
-        # If entries are filled up to a date, start only at that date next time
-        # Also: we might expect data only up to today
-        needed_data = set([])
-        date_study = self.user.look_for_data_starting_at
-        date_current = datetime.date.today()
-        while date_study < date_current:
-            # Adding morning and afternoon if not the week-end
-            if date_study.weekday() < 5:
-                needed_data.add(str(date_study) + "_0")
-                needed_data.add(str(date_study) + "_1")
-            date_study = date_study + datetime.timedelta(days=1)
-
-        # Current day is special: depending on the time, we might expect morning and/or afternoon
-        if date_current.weekday() < 5:
-            if self.user.look_for_data_starting_at <= date_current:
-                current_tz_hour = datetime.datetime.now(
-                    tz=pytz.timezone(self.user.working_timezone)
-                ).hour
-                if current_tz_hour >= settings.config["MORNING_ENDS_AT"]:
-                    needed_data.add(str(date_current) + "_0")
-                if current_tz_hour >= settings.config["AFTERNOON_ENDS_AT"]:
-                    needed_data.add(str(date_current) + "_1")
-
-        return needed_data
-
-    def find_available_data(self):
-        """Returns all already filled timeslots for user"""
-
-        available_data = set([])
-        for one_data in TimeEntry.objects.filter(
-            user=self.user.pk,
-            date__gte=self.user.look_for_data_starting_at,
-            program__isnull=False,
-        ).values("description", "date", "is_morning"):
-            postfix_day_period = "_0" if one_data["is_morning"] else "_1"
-            available_data.add(str(one_data["date"]) + postfix_day_period)
-
-        return available_data
+        return set(self.get_slot_summary().missing_time_slots)
+
+    def get_slot_summary(self):
+        """Up to date summary of the user's missing time slots"""
+
+        with metrics.find_missing_data_seconds.time():
+            return get_slot_summaries([self.user])[self.user.pk]
 
     def register_changes(self, date_object, change_type, change_dict):
         """New infos. have been sent; let's store those new infos"""
 
-        # Retrieve the data for user/timeslot or create if necessary
-        time_entry = TimeEntry.objects.filter(
-            user=self.user,
-            date=date_object["date"],
-            is_morning=date_object["is_morning"],
-            is_afternoon=date_object["is_afternoon"],
-        ).first()
-
-        if time_entry is None:
-            time_entry = TimeEntry(
+        # Without form data, only make sure the entry exists
+        if change_type != "submit":
+            time_entry, _ = TimeEntry.objects.get_or_create(
                 user=self.user,
-                description="",
                 date=date_object["date"],
                 is_morning=date_object["is_morning"],
                 is_afternoon=date_object["is_afternoon"],
+                defaults={"description": ""},
             )
-            time_entry.save()
-
-        # Form has been sent, hence we expect new infos. about activity description
-        if change_type == "submit":
-            description = change_dict["description-block"]["description-action"][
-                "value"
-            ]
-
-            if description is None:
-                description = ""
+            self.send_summary_to_user_as_dm(time_entry)
+            return
 
-            time_entry.description = description.strip()
-            time_entry.save()
+        # Form has been sent: description and work type are stored even without a valid program
+        submitted_values = self.get_submitted_values(change_dict)
+        update_fields = ["description", "work_type", "modification_time"]
+        if submitted_values["program"] is not None:
+            update_fields.append("program")
 
-            work_type_selected_option = change_dict["work-type-block"][
-                "work-type-action"
-            ]["selected_option"]
-            work_type = None
+        # Single statement: the entry is created, or its submitted fields are updated
+        time_entry = TimeEntry(
+            user=self.user,
+            date=date_object["date"],
+            is_morning=date_object["is_morning"],
+            is_afternoon=date_object["is_afternoon"],
+            **submitted_values,
+        )
+        # Committed with the summary update: a filled slot never stays listed as missing
+        with transaction.atomic():
+            lock_users([self.user.pk])
+            TimeEntry.objects.bulk_create(
+                [time_entry],
+                update_conflicts=True,
+                unique_fields=["user", "date", "is_morning"],
+                update_fields=update_fields,
+            )
+            if submitted_values["program"] is not None:
+                # Bulk statements don't send signals
+                mark_time_slots_filled(
+                    self.user.pk,
+                    [get_time_slot(date_object["date"], date_object["is_morning"])],
+                )
 
-            if work_type_selected_option is not None:
-                work_type = WorkType.objects.filter(
-                    slack_value=work_type_selected_option["value"]
-                ).first()
+        if submitted_values["program"] is not None:
+            self.send_summary_to_user_as_dm(time_entry)
 
-            time_entry.work_type = work_type
-            time_entry.save()
+    def get_submitted_values(self, change_dict):
+        """Reads description, work type and program of a submitted modal
 
-            program_selected_option = change_dict["program-block"]["program-action"][
-                "selected_option"
-            ]
+        Program is None, after warning user, if no valid program was selected.
+        """
 
-            if program_selected_option is None:
-                self.query_sender.send_simple_message(
-                    ":warning: The _program_ field is mandatory to submit a timesheet entry. Please fill out the form again :pray:",
-                    self.user.slack_userid,
-                )
-                return
+        description = change_dict["description-block"]["description-action"]["value"]
+        if description is None:
+            description = ""
 
-            program = Program.objects.filter(
-                slack_value=program_selected_option["value"]
-            ).first()
+        work_type_selected_option = change_dict["work-type-block"]["work-type-action"][
+            "selected_option"
+        ]
+        work_type = None
+        if work_type_selected_option is not None:
+            work_type = get_work_types_by_slack_value().get(
+                work_type_selected_option["value"]
+            )
 
+        program_selected_option = change_dict["program-block"]["program-action"][
+            "selected_option"
+        ]
+        program = None
+        if program_selected_option is None:
+            self.query_sender.send_simple_message(
+                ":warning: The _program_ field is mandatory to submit a timesheet entry. Please fill out the form again :pray:",
+                self.user.slack_userid,
+            )
+        else:
+            program = get_programs_by_slack_value().get(
+                program_selected_option["value"]
+            )
             if program is None:
                 self.query_sender.send_simple_message(
                     f":warning: The _program_ you have selected "
@@ -148,71 +237,69 @@ class UserAnalyzer:
                     + "Please inform the administrator ASAP :pray:",
                     self.user.slack_userid,
                 )
-                return
 
-            time_entry.program = program
-
-        time_entry.save()
+        return {
+            "description": description.strip(),
+            "work_type": work_type,
+            "program": program,
+        }
+
+    def register_week_changes(self, time_slots, change_dict):
+        """Stores the same infos. for several time slots at once, then sends a single summary"""
+
+        submitted_values = self.get_submitted_values(change_dict)
+        if submitted_values["program"] is None or not len(time_slots):
+            return
+
+        # Single statement: new slots are inserted, already started ones are overwritten
+        # Committed with the summary update, the user being locked first as when summaries are read
+        with transaction.atomic():
+            lock_users([self.user.pk])
+            TimeEntry.objects.bulk_create(
+                [
+                    TimeEntry(
+                        user=self.user,
+                        date=get_time_slot_date(time_slot),
+                        is_morning=is_morning_time_slot(time_slot),
+                        is_afternoon=not is_morning_time_slot(time_slot),
+                        **submitted_values,
+                    )
+                    for time_slot in time_slots
+                ],
+                update_conflicts=True,
+                unique_fields=["user", "date", "is_morning"],
+                update_fields=[
+                    "description",
+                    "is_afternoon",
+                    "program",
+                    "work_type",
+                    "modification_time",
+                ],
+            )
+            # Bulk statements don't send signals
+            mark_time_slots_filled(self.user.pk, time_slots)
 
-        self.send_summary_to_user_as_dm(time_entry)
+        self.send_week_summary_to_user_as_dm(time_slots, **submitted_values)
 
-    def launch_notifications(self):
-        """Launch notifications inviting user to fill the missing entries"""
+    def send_week_summary_to_user_as_dm(
+        self, time_slots, description, work_type, program
+    ):
+        """When several entries are filled at once, publish infos. in a single message"""
 
-        # Notifications can be sent only at configured hours for current user
-        current_tz_time = datetime.datetime.now(
-            tz=pytz.timezone(self.user.working_timezone)
+        dates = "\n".join(
+            f"- {format_date(time_slot)}" for time_slot in sorted(time_slots)
         )
-        current_tz_hour = current_tz_time.hour
-        user_hour_notif = NotificationHour.objects.filter(
-            user=self.user.pk, timezone_hour=current_tz_hour
-        ).first()
-        if user_hour_notif is not None:
-            # And we send notifications only if there are entries that actually must be filled
-            count_missing_data = len(self.find_missing_data())
-            if count_missing_data:
-                # We notify only if last notification is old enough according to configuration
-                if (
-                    self.user.last_notified
-                    + datetime.timedelta(
-                        hours=self.user.min_hours_between_notifications
-                    )
-                ) <= current_tz_time:
-                    # Skip notifications on WE if settings say so
-                    if (settings.config["SKIP_NOTIFICATIONS_ON_WE"]) and (
-                        current_tz_time.weekday() >= 5
-                    ):
-                        return
-                    # Relies on dedicated class for the sending & update last notification timestamp
-                    self.query_sender.prepare_and_send_notification(
-                        self.user, count_missing_data
-                    )
-                    self.update_user_latest_notification()
-
-    def update_user_analysis_mindate(self):
-        """Updates the user starting point for missing data analysis"""
-
-        # Look for missing entries according to current starting point
-        missing_data = self.find_missing_data()
-        if len(missing_data):
-            # The new starting point may be the first missing point if there are some
-            first_missing_date = [
-                int(part) for part in sorted(missing_data)[0].split("_")[0].split("-")
-            ]
-            self.user.look_for_data_starting_at = datetime.date(*first_missing_date)
-        else:
-            # Else, we can start future analysis directly at the current day
-            self.user.look_for_data_starting_at = datetime.date.today()
-
-        self.user.save()
-
-    def update_user_latest_notification(self):
-        """Updates user last notification timestamp"""
+        work_type = work_type.slack_description if work_type is not None else "None"
 
-        self.user.last_notified = datetime.datetime.now(
-            tz=pytz.timezone(self.user.working_timezone)
+        text = (
+            f"*{len(time_slots)} half-days* :\n"
+            + f"{dates}\n"
+            + f"- _Work type_ : {work_type}\n"
+            + f"- _Program_ : {program.slack_description}\n"
+            + f"- _Description_ : {description}"
         )
-        self.user.save()
+
+        self.query_sender.send_simple_message(text, self.user.slack_userid)
 
     def send_summary_to_user_as_dm(self, time_entry: TimeEntry):
         """When a new entry is complete, publish infos. to the associated public channel if needed"""